@@ -1,5 +1,7 @@
 import os
 import sys
+import asyncio
+from contextvars import ContextVar
 
 parent_dir = os.path.abspath(os.path.join(os.getcwd(), "../../"))
 
@@ -19,6 +21,17 @@ from index_maker.index_maker import make_index_tool
 
 INDEX_AGENT_MODEL = os.getenv("INDEX_AGENT_MODEL")
 
+# (start_date, end_date) of the API request being served, set by the endpoint
+requested_date_range = ContextVar('requested_date_range', default=(None, None))
+
+
+async def make_index_tool_async(input_text: str = ""):
+    # The agent awaits its tools in the request's own task, so the range is read here and passed on explicitly,
+    # whether or not the thread that runs make_index_tool gets a copy of the request context.
+    start_date, end_date = requested_date_range.get()
+    ticker_input = input_text.strip() if input_text else None
+    return await asyncio.to_thread(make_index_tool, ticker_input, start_date=start_date, end_date=end_date)
+
 from langchain_core.prompts import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
@@ -69,10 +82,14 @@ tools = [
         name="Index",
         #func=make_index_tool,
         func=lambda input_text: make_index_tool(input_text.strip()) if input_text else make_index_tool(),
+        coroutine=make_index_tool_async,
         return_direct=True,
         description="""Use when asked to create a historical simulation of the Index or to make an index.
         If specific tickers are mentioned in the prompt (e.g., "Make Index AAPL, MSFT"), use them as input.
         If no tickers are provided in the prompt  (e.g., "Make Index") use "" as input.
+        If the prompt asks for a period (e.g., "Make Index AAPL, MSFT since 2020" or "from 2022-01-03 to 2023-06-30"),
+        append the start date and optionally the end date in YYYY-MM-DD format (e.g., "AAPL, MSFT, 2020-01-01").
+        Without tickers use only the dates as input (e.g., "2020-01-01").
         """
     ),
 ]
@@ -3,7 +3,7 @@ import os
 import asyncio
 import logging
 from fastapi import FastAPI, HTTPException
-from agents.index_rag_agent import index_rag_agent_executor
+from agents.index_rag_agent import index_rag_agent_executor, requested_date_range
 from chatbot_api.src.models.index_rag_models import IndexQueryInput, IndexQueryOutput
 from chatbot_api.src.utils.utils import *
 from utils.parser import parse_intermediate_steps, parse_cypher_tickers, parse_description_tickers
@@ -58,6 +58,9 @@ async def query_index_agent(query: IndexQueryInput) -> IndexQueryOutput:
 
         chat_history = chat_memory_store[user_id]
 
+        # The Index tool takes the date range from the request, not from the prompt
+        requested_date_range.set((query.start_date, query.end_date))
+
         agent_input = {
             "input": query.text,
             "chat_history": chat_history # Set to None to if you don't want the agent to use the chat history
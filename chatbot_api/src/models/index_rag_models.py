@@ -3,6 +3,8 @@ from typing import List, Optional, Any
 
 class IndexQueryInput(BaseModel):
     text: str
+    start_date: Optional[str] = None    # YYYY-MM-DD, rebases the index to this date
+    end_date: Optional[str] = None      # YYYY-MM-DD
     #tickers: Optional[List] = None 
 
 class IndexQueryOutput(BaseModel):
@@ -397,7 +397,8 @@ if prompt := st.chat_input("What do you want to know?"):
             time_series.index.name = "Date"
 
             output_text = ticker_list + "\n\n" + removed_tickers
-            additional_text_index = "\n\n**Here is the historical index performance since 2015**"
+            date_range = f"from {time_series.index.min():%Y-%m-%d} to {time_series.index.max():%Y-%m-%d}" if not time_series.empty else ""
+            additional_text_index = f"\n\n**Here is the historical index performance {date_range}**"
 
             st.chat_message("assistant", avatar=logo_path_small_sky).markdown(output_text)
             #st.line_chart(time_series)
@@ -1,37 +1,130 @@
 import sqlite3
 import logging
+import pandas as pd
 from datetime import datetime
+from contextlib import contextmanager
 import os
 from dotenv import load_dotenv
 
 
 db_file = "../stocks_data.db"
-conn = sqlite3.connect(db_file)
-cursor = conn.cursor()
 
+# per-connection settings, see connect(); WAL lets the notebooks read while a load is writing
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",    # fsync at checkpoints instead of every commit, safe with WAL
+    "cache_size": -262144,      # 256 MB page cache (negative = KiB)
+    "temp_store": "MEMORY",
+    "mmap_size": 1073741824,
+}
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS hist_prices (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    symbol TEXT NOT NULL,
-    date TEXT NOT NULL,
-    close REAL NOT NULL,
-    volume INTEGER NOT NULL,
-    UNIQUE(symbol, date) ON CONFLICT IGNORE
-);
-""")
-conn.commit()
+# hist tables are clustered on (symbol, date) with dates stored as YYYYMMDD integers
+HIST_TABLES = {
+    "hist_prices": ["close REAL NOT NULL", "volume INTEGER NOT NULL"],
+    "hist_mcaps": ["mcap REAL NOT NULL"],
+}
+DATE_TO_INT = "CAST(REPLACE({}, '-', '') AS INTEGER)"
+INT_TO_DATE = "printf('%04d-%02d-%02d', {0} / 10000, {0} / 100 % 100, {0} % 100)"
 
+_bulk_connections = set()   # id() of the connections inside bulk_load, their inserts leave committing to it
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS hist_mcaps (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    symbol TEXT NOT NULL,
-    date TEXT NOT NULL,
-    mcap REAL NOT NULL,
-    UNIQUE(symbol, date) ON CONFLICT IGNORE
-);
-""")
+
+def connect(path=None, pragmas=None):
+    conn = sqlite3.connect(path or db_file)
+    for name, value in {**PRAGMAS, **(pragmas or {})}.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    # explicit BEGIN IMMEDIATE / COMMIT: every statement inside, DDL included, is committed or rolled back together
+    conn.commit()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None     # no implicit BEGIN/COMMIT from the sqlite3 module
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def table_exists(conn, table_name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+
+
+def hist_table_sql(table_name):
+    columns = ",\n        ".join(HIST_TABLES[table_name])
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        symbol TEXT NOT NULL,
+        date INTEGER NOT NULL,
+        {columns},
+        PRIMARY KEY (symbol, date) ON CONFLICT IGNORE
+    ) WITHOUT ROWID
+    """
+
+
+def create_hist_table(conn, table_name):
+    conn.execute(hist_table_sql(table_name))
+    conn.commit()
+
+
+def migrate_hist_tables(conn):
+    # Databases built before the compact layout have an AUTOINCREMENT id, TEXT dates and a UNIQUE index.
+    # They are copied into the WITHOUT ROWID tables in primary key order, rename to drop in one transaction.
+    # A {table}_old left behind by an interrupted earlier migration is finished the same way; rows loaded into
+    # the new table since then are kept (the primary key ignores the duplicates).
+    migrated = False
+    for table_name, column_defs in HIST_TABLES.items():
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+        if "id" not in columns and not table_exists(conn, f"{table_name}_old"):
+            continue
+
+        value_columns = ", ".join(column.split()[0] for column in column_defs)
+        with transaction(conn):
+            if "id" in columns:
+                conn.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_old")
+            conn.execute(hist_table_sql(table_name))
+            conn.execute(f"""
+            INSERT INTO {table_name} (symbol, date, {value_columns})
+            SELECT symbol, {DATE_TO_INT.format('date')}, {value_columns} FROM {table_name}_old
+            ORDER BY symbol, date
+            """)
+            conn.execute(f"DROP TABLE {table_name}_old")
+        print(f"{table_name} migrated to WITHOUT ROWID table with integer dates")
+        migrated = True
+
+    if migrated:
+        conn.execute("VACUUM")  # give the pages of the old tables back
+
+
+@contextmanager
+def bulk_load(conn):
+    # For large first loads: one transaction without fsyncs. insert_hist_* calls on this connection do not
+    # commit until the block ends, and everything inside is rolled back if the load fails.
+    conn.commit()
+    conn.execute("PRAGMA synchronous = OFF")
+    _bulk_connections.add(id(conn))
+    try:
+        with transaction(conn):
+            yield conn
+    finally:
+        _bulk_connections.discard(id(conn))
+        conn.execute(f"PRAGMA synchronous = {PRAGMAS['synchronous']}")
+
+
+conn = connect()
+cursor = conn.cursor()
+
+migrate_hist_tables(conn)
+for table_name in HIST_TABLES:
+    create_hist_table(conn, table_name)
+    conn.execute(f"DROP INDEX IF EXISTS idx_{table_name}_date")   # unused date index of earlier builds
 conn.commit()
 
 
@@ -54,12 +147,48 @@ cursor.execute(f"""
     """)
 conn.commit()
 
-cursor.execute("""
+# long format, one row per pair and date: loading a pair is one executemany instead of a column per pair
+EXCHANGE_RATES_SQL = """
 CREATE TABLE IF NOT EXISTS exchange_rates (
-    date TEXT PRIMARY KEY
+    pair TEXT NOT NULL,
+    date TEXT NOT NULL,
+    rate REAL,
+    PRIMARY KEY (pair, date)
 )
-""")
-conn.commit()
+"""
+
+
+def create_exchange_rates_table(conn):
+    conn.execute(EXCHANGE_RATES_SQL)
+    conn.commit()
+
+
+def migrate_wide_exchange_rates(conn):
+    # Databases built before the long format have one column per pair, moved into (pair, date, rate) rows
+    # in one transaction. An exchange_rates_wide left by an interrupted earlier migration is finished.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(exchange_rates)")]
+    wide_columns = columns if columns and "pair" not in columns else None
+    if wide_columns is None and table_exists(conn, "exchange_rates_wide"):
+        wide_columns = [row[1] for row in conn.execute("PRAGMA table_info(exchange_rates_wide)")]
+    if wide_columns is None:
+        return
+
+    pairs = [column for column in wide_columns if column != "date"]
+    with transaction(conn):
+        if columns and "pair" not in columns:
+            conn.execute("ALTER TABLE exchange_rates RENAME TO exchange_rates_wide")
+        conn.execute(EXCHANGE_RATES_SQL)
+        for pair in pairs:
+            conn.execute(f"""
+            INSERT OR IGNORE INTO exchange_rates (pair, date, rate)
+            SELECT ?, date, "{pair}" FROM exchange_rates_wide WHERE "{pair}" IS NOT NULL
+            """, (pair,))
+        conn.execute("DROP TABLE exchange_rates_wide")
+    print(f"exchange_rates migrated to long format: {len(pairs)} pairs")
+
+
+migrate_wide_exchange_rates(conn)
+create_exchange_rates_table(conn)
 
 
 ###########################################################
@@ -68,12 +197,13 @@ def insert_hist_prices(records, conn):
 
     cursor = conn.cursor()
 
-    insert_query = """
+    insert_query = f"""
     INSERT INTO hist_prices (symbol, date, close, volume)
-    VALUES (:symbol, :date, :close, :volume)
+    VALUES (:symbol, {DATE_TO_INT.format(':date')}, :close, :volume)
     """
     cursor.executemany(insert_query, records)
-    conn.commit()
+    if id(conn) not in _bulk_connections:
+        conn.commit()
 
 
 
@@ -81,27 +211,40 @@ def insert_hist_mcaps(records, conn):
 
     cursor = conn.cursor()
 
-    insert_query = """
+    insert_query = f"""
     INSERT INTO hist_mcaps (symbol, date, mcap)
-    VALUES (:symbol, :date, :marketCap)
+    VALUES (:symbol, {DATE_TO_INT.format(':date')}, :marketCap)
     """
     cursor.executemany(insert_query, records)
-    conn.commit()
+    if id(conn) not in _bulk_connections:
+        conn.commit()
+
+
+def get_last_dates(table_name, conn):
+    # last stored date per symbol ('YYYY-MM-DD') in one grouped query, used to request only the missing range
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT symbol, {INT_TO_DATE.format('MAX(date)')} FROM {table_name} GROUP BY symbol")
+    return dict(cursor.fetchall())
+
+
+def read_hist_table(table_name, conn):
+    # long frame with 'YYYY-MM-DD' dates, as SELECT * returned before the integer date layout
+    value_columns = ", ".join(column.split()[0] for column in HIST_TABLES[table_name])
+    return pd.read_sql_query(f"SELECT symbol, {INT_TO_DATE.format('date')} AS date, {value_columns} FROM {table_name}", conn)
 
 
 def write_ccy_data(cursor, ccy_pair, stock_data, table_name):
-        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN '{ccy_pair}' REAL")
+    cursor.executemany(f"INSERT OR REPLACE INTO {table_name} (pair, date, rate) VALUES (?, ?, ?)",
+                       [(ccy_pair, record['date'], record['close']) for record in stock_data])
+    cursor.connection.commit()  # one transaction per pair
 
-        for record in stock_data:
-            date = record['date']
-            close = record['close']
 
-            cursor.execute(f"SELECT 1 FROM {table_name} WHERE date = ?", (date,))
-            if cursor.fetchone():
-                cursor.execute(f"UPDATE {table_name} SET '{ccy_pair}' = ? WHERE date = ?", (close, date))
-            else:
-                cursor.execute(f"INSERT INTO {table_name} (date, '{ccy_pair}') VALUES (?, ?)", (date, close))
-            conn.commit()
+def read_exchange_rates(conn, table_name="exchange_rates"):
+    # wide frame (date + one column per pair) as transform_stock_info and fx_converter expect it
+    long_rates = pd.read_sql_query(f"SELECT pair, date, rate FROM {table_name}", conn)
+    forex_rates = long_rates.pivot(index="date", columns="pair", values="rate").reset_index()
+    forex_rates.columns.name = None
+    return forex_rates
 
 
 
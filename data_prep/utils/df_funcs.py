@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
+import polars as pl
 from langchain.text_splitter import CharacterTextSplitter
-from scipy.stats import percentileofscore
 
 def fx_converter(df1, df2, mapping_dict):
     merged = pd.merge(df1, df2, on='date', how='inner')
@@ -63,70 +63,93 @@ def transpose_df(df, values):
     return df
 
 
-def remove_stocks_witn_no_recent_values(df):
-    last_values = df[(df['date'] >= '2024-11-01') & (df['date'] <= '2024-11-29')]
+def remove_stocks_witn_no_recent_values(df, recent_days=28):
+    # keeps the stocks with a value in the last recent_days before the last date of the panel
+    last_date = pd.to_datetime(df['date']).max()
+    first_recent_date = (last_date - pd.Timedelta(days=recent_days)).strftime('%Y-%m-%d')
+    last_values = df[(df['date'] >= first_recent_date) & (df['date'] <= last_date.strftime('%Y-%m-%d'))]
     df_select = df.loc[:, last_values.notna().any()]
     return df_select
 
 
-def remove_stocks_with_gaps(df, gap_size):
+def remove_stocks_with_gaps(df, gap_size, chunk_columns=1024):
     df = df.sort_values(by='date', ascending=True).reset_index(drop=True)
     data = df.iloc[:, 1:].to_numpy() 
     column_names = df.columns[1:]  
 
     columns_with_nan_clusters = {}
 
-    for col_idx in range(data.shape[1]):
-        col_data = data[:, col_idx]
+    # run-length encoding of the NaN streaks of a block of columns at once, in chunks to bound the memory:
+    # streak = NaNs so far - NaNs so far at the last value, only counted after the first value
+    for start in range(0, data.shape[1], chunk_columns):
+        nan_mask = np.isnan(data[:, start:start + chunk_columns])
+        nan_count = np.cumsum(nan_mask, axis=0, dtype=np.int32)
+        streak = nan_count - np.maximum.accumulate(np.where(nan_mask, 0, nan_count), axis=0)
+        listed = np.logical_or.accumulate(~nan_mask, axis=0)
 
-        first_valid_idx = np.argmax(~np.isnan(col_data)) 
+        too_long = (streak > gap_size) & listed
+        has_gap = too_long.any(axis=0)
+        first_gap_idx = too_long.argmax(axis=0)
 
-        # Skip the column if it is entirely NaN
-        if np.isnan(col_data[first_valid_idx]):
-            columns_with_nan_clusters[column_names[col_idx]] = None
-            continue
+        for col_idx in range(nan_mask.shape[1]):
+            if not listed[-1, col_idx]:     # entirely NaN
+                columns_with_nan_clusters[column_names[start + col_idx]] = None
+            elif has_gap[col_idx]:
+                columns_with_nan_clusters[column_names[start + col_idx]] = first_gap_idx[col_idx]
 
-        stripped_col = col_data[first_valid_idx:]
-        nan_mask = np.isnan(stripped_col)
+    final_df = df.drop(columns=list(columns_with_nan_clusters.keys()))
 
-        current_streak = 0 
-        for idx, value in enumerate(nan_mask):
-            if value:  
-                current_streak += 1
+    return columns_with_nan_clusters, final_df
 
-                if current_streak > gap_size:
 
-                    columns_with_nan_clusters[column_names[col_idx]] = first_valid_idx + idx
-                    break
-            else:
-                current_streak = 0
+def make_date_grid(dfs, calendar='D', start_date='2014-01-01', end_date=None, holidays=None):
+    # calendar: 'D' calendar days, 'B' Monday-Friday (minus holidays), 'data' the dates present in the panels,
+    # or an explicit list/DatetimeIndex of trading dates (e.g. from an exchange calendar).
+    # With 'B', values on weekend dates (e.g. Sunday trading exchanges) are dropped.
+    observed_dates = pd.DatetimeIndex(pd.concat([pd.to_datetime(df['date']) for df in dfs]).unique()).sort_values()
+    if end_date is None:
+        end_date = observed_dates.max()  # the panel ends with the data, not on a fixed date
 
-    final_df = df.drop(columns=list(columns_with_nan_clusters.keys()))
+    if isinstance(calendar, str) and calendar == 'D':
+        date_grid = pd.date_range(start=start_date, end=end_date)
+    elif isinstance(calendar, str) and calendar == 'B':
+        date_grid = pd.bdate_range(start=start_date, end=end_date, freq='C', holidays=holidays)
+    elif isinstance(calendar, str) and calendar == 'data':
+        date_grid = observed_dates
+    elif isinstance(calendar, str):
+        raise ValueError(f"Invalid calendar {calendar}, use 'D', 'B', 'data' or a list of trading dates")
+    else:
+        date_grid = pd.DatetimeIndex(pd.to_datetime(calendar)).unique().sort_values()
 
-    return columns_with_nan_clusters, final_df
+    return date_grid[(date_grid >= pd.Timestamp(start_date)) & (date_grid <= pd.Timestamp(end_date))]
 
 
-def assign_dates(df):
+def assign_dates(df, calendar='D', start_date='2014-01-01', end_date=None, holidays=None):
     df['date'] = pd.to_datetime(df['date'])
-    full_date_range = pd.date_range(start='2014-01-01', end='2024-12-01')
+    full_date_range = make_date_grid([df], calendar=calendar, start_date=start_date, end_date=end_date, holidays=holidays)
     full_df = pd.DataFrame({'date': full_date_range})
     merged_df = pd.merge(full_df, df, on='date', how='left')
     merged_df = merged_df.sort_values(by='date', ascending=True).reset_index(drop=True)
     return merged_df
 
 
-def process_data(stock_prices, stock_mcaps, gap_size):   
+def process_data(stock_prices, stock_mcaps, gap_size, calendar='D', start_date='2014-01-01', end_date=None, holidays=None):   
 
     pc = remove_stocks_witn_no_recent_values(stock_prices)
     _, pc_no_gap = remove_stocks_with_gaps(pc, gap_size=gap_size)
-    pc_final = assign_dates(pc_no_gap)
+
+    mc = remove_stocks_witn_no_recent_values(stock_mcaps)
+    _, mc_no_gap = remove_stocks_with_gaps(mc, gap_size=gap_size)
+
+    # one grid for both panels, so prices and market caps stay row-aligned
+    date_grid = make_date_grid([pc_no_gap, mc_no_gap], calendar=calendar, start_date=start_date, end_date=end_date, holidays=holidays)
+
+    pc_final = assign_dates(pc_no_gap, calendar=date_grid, start_date=start_date, end_date=date_grid[-1])
 
     pc_final_inter = pc_final.copy()
     pc_final_inter.iloc[:, 1:] = pc_final_inter.iloc[:, 1:].interpolate(method="linear", limit_direction="forward", axis=0)
 
-    mc = remove_stocks_witn_no_recent_values(stock_mcaps)
-    _, mc_no_gap = remove_stocks_with_gaps(mc, gap_size=gap_size)
-    mc_final = assign_dates(mc_no_gap)
+    mc_final = assign_dates(mc_no_gap, calendar=date_grid, start_date=start_date, end_date=date_grid[-1])
 
     mc_final_inter = mc_final.copy()
     mc_final_inter.iloc[:, 1:] = mc_final_inter.iloc[:, 1:].interpolate(method="linear", limit_direction="forward", axis=0)
@@ -214,57 +237,198 @@ def trim_stocks_with_little_data(df1, df2, days):
     return df1, df2, removed_stocks
 
 
-def calculate_annualized_volatilities(df):
-    df = df[df['date']>='2020-01-01'] # select the last 5 years to calculate annualized volatilities
-    stocks = df.iloc[:, 1:]  
-    annualized_volatilities = {}
-    for stock in stocks.columns:
+def prepare_panels(stock_prices, stock_mcaps, gap_size, days, engine='pandas', calendar='D', start_date='2014-01-01', end_date=None, holidays=None):
+    # process_data -> align_prices_and_mcaps -> trim_stocks_with_little_data with either engine,
+    # returns prices_trimmed, mcaps_trimmed, removed_stocks as pandas frames in both cases
+    if engine == 'pandas':
+        pc_final_inter, mc_final_inter = process_data(stock_prices, stock_mcaps, gap_size, calendar=calendar, start_date=start_date, end_date=end_date, holidays=holidays)
+        prices, mcaps = align_prices_and_mcaps(pc_final_inter, mc_final_inter)
+        return trim_stocks_with_little_data(prices, mcaps, days)
 
-        prices = stocks[stock].dropna()
-        daily_returns = prices.pct_change().dropna()
+    if engine == 'polars':
+        pc_final_inter, mc_final_inter = process_data_polars(stock_prices, stock_mcaps, gap_size, calendar=calendar, start_date=start_date, end_date=end_date, holidays=holidays)
+        prices, mcaps = align_prices_and_mcaps_polars(pc_final_inter, mc_final_inter)
+        prices, mcaps, removed_stocks = trim_stocks_with_little_data_polars(prices, mcaps, days)
+        return to_pandas_panel(prices), to_pandas_panel(mcaps), removed_stocks
 
-        daily_volatility = daily_returns.std()
-        annualized_volatility = daily_volatility * np.sqrt(252)
+    raise ValueError(f"Invalid engine {engine}, use 'pandas' or 'polars'")
 
-        annualized_volatilities[stock] = annualized_volatility
 
-    return annualized_volatilities
+def compare_engines(stock_prices, stock_mcaps, gap_size, days, rtol=1e-9, **kwargs):
+    # runs both engines on the same panels and raises an AssertionError if the outputs differ
+    # (interpolated values may differ in the last bits, hence rtol)
+    pandas_result = prepare_panels(stock_prices.copy(), stock_mcaps.copy(), gap_size, days, engine='pandas', **kwargs)
+    polars_result = prepare_panels(stock_prices.copy(), stock_mcaps.copy(), gap_size, days, engine='polars', **kwargs)
 
+    for pandas_df, polars_df in zip(pandas_result[:2], polars_result[:2]):
+        pd.testing.assert_frame_equal(pandas_df.reset_index(drop=True), polars_df, check_exact=False, rtol=rtol)
+    assert pandas_result[2] == polars_result[2], "removed stocks differ"
 
-def calculate_number_of_price_data_points(df):
-        stocks = df.iloc[:, 1:]  
-        number_of_data_points = {}
-        for stock in stocks.columns:
-            prices = stocks[stock].dropna()
-            number_of_data_points[stock] = len(prices)
-    
-        return number_of_data_points
+    print("Engines match: ", pandas_result[0].shape, pandas_result[1].shape)
+    return True
+
+
+# Polars engine, same outputs as the pandas functions above. Every per-stock step is one expression
+# per column over the whole panel, which Polars runs multi-threaded. Only the date window filter is lazy:
+# with thousands of columns the lazy planner costs more than the queries (14s vs 0.9s for the gap scan of 3000 stocks).
+
+def to_polars_panel(df):
+    panel = pl.from_pandas(df)  # NaN -> null
+    if panel.schema['date'] == pl.String:
+        return panel.with_columns(pl.col('date').str.to_date())
+    return panel.with_columns(pl.col('date').cast(pl.Date))
+
+
+def to_pandas_panel(panel):
+    return panel.with_columns(pl.col('date').cast(pl.Datetime('ns'))).to_pandas()
+
+
+def max_gap_expr(stock):
+    # longest null streak after the first value, null for stocks without any value
+    is_null = pl.col(stock).is_null()
+    null_count = is_null.cum_sum()
+    streak = null_count - pl.when(~is_null).then(null_count).forward_fill().fill_null(0)
+    listed = pl.col(stock).is_not_null().cum_max()
+    return pl.when(listed).then(streak).max().alias(stock)
+
+
+def select_stocks_polars(df, gap_size, recent_days=28):
+    # remove_stocks_witn_no_recent_values and remove_stocks_with_gaps as two aggregations
+    last_date = df['date'].max()
+    recent = df.lazy().filter(pl.col('date').is_between(last_date - pd.Timedelta(days=recent_days), last_date))
+    has_recent = recent.select(pl.exclude('date').is_not_null().any()).collect().row(0, named=True)
+    stocks = [stock for stock, has_values in has_recent.items() if has_values]
+
+    max_gaps = df.select(['date'] + stocks).sort('date').select([max_gap_expr(stock) for stock in stocks]).row(0, named=True)
+    return [stock for stock in stocks if max_gaps[stock] is not None and max_gaps[stock] <= gap_size]
+
+
+def process_data_polars(stock_prices, stock_mcaps, gap_size, calendar='D', start_date='2014-01-01', end_date=None, holidays=None):
+    pc = to_polars_panel(stock_prices)
+    mc = to_polars_panel(stock_mcaps)
+
+    pc_stocks = select_stocks_polars(pc, gap_size)
+    mc_stocks = set(select_stocks_polars(mc, gap_size))
+    common_stocks = [stock for stock in pc_stocks if stock in mc_stocks]
+
+    # same shared grid as process_data
+    observed_dates = [df.select('date').to_pandas() for df in (pc, mc)]
+    date_grid = make_date_grid(observed_dates, calendar=calendar, start_date=start_date, end_date=end_date, holidays=holidays)
+    grid = pl.DataFrame({'date': pl.Series(date_grid.values).cast(pl.Date)})
+
+    # interpolate() leaves trailing nulls, pandas' forward linear interpolation repeats the last value
+    pc_final_inter, mc_final_inter = [grid.join(df.select(['date'] + common_stocks), on='date', how='left')
+                                          .sort('date')
+                                          .with_columns(pl.exclude('date').interpolate().forward_fill())
+                                      for df in (pc, mc)]
+    return pc_final_inter, mc_final_inter
 
 
-def calculate_annualized_returns(df):
-    df = df[df['date']>='2020-01-01'] # select the last 5 years to calculate annualized returns
-    stocks = df.iloc[:, 1:] 
-    annualized_returns = {}
-    for stock in stocks.columns:
+def align_prices_and_mcaps_polars(df1, df2):
+    stocks = df1.columns[1:]
+    first_dates = [df.select([pl.col('date').filter(pl.col(stock).is_not_null()).first().alias(stock) for stock in stocks]).row(0)
+                   for df in (df1, df2)]
 
-        prices = stocks[stock].dropna()
-        daily_returns = prices.pct_change().dropna()
+    dropped_stocks, cutoff_dates = [], {}
+    for stock, first_date_prices, first_date_market_cap in zip(stocks, *first_dates):
+        if first_date_prices is not None and first_date_prices == first_date_market_cap:
+            continue
+        if first_date_prices is not None and first_date_market_cap is not None and 1 <= (first_date_market_cap - first_date_prices).days <= 10:
+            cutoff_dates[stock] = first_date_market_cap
+        else:
+            dropped_stocks.append(stock)
+
+    print('Number of misaligned Stocks: ', len(stocks))
+    print('Number of Stocks for which NaN were introduced: ', len(cutoff_dates))
+    print('Number of Stocks dropped in both Dataframes: ', len(dropped_stocks), "\n")
+
+    df_prices = df1.drop(dropped_stocks).with_columns([
+        pl.when(pl.col('date') < cutoff_date).then(None).otherwise(pl.col(stock)).alias(stock)
+        for stock, cutoff_date in cutoff_dates.items()
+    ])
+    df_market_cap = df2.drop(dropped_stocks)
+    return df_prices, df_market_cap
+
+
+def trim_stocks_with_little_data_polars(df1, df2, days):
+
+    print("Stock number before trimming: ", len(df1.columns), len(df2.columns))
+    non_nan_counts = pd.Series(df1.select(pl.all().count()).row(0, named=True))
+    result_df = pd.DataFrame({'stock': non_nan_counts.index, 'count': non_nan_counts.values})
+    result_df = result_df.sort_values(by='count')
+    result_df = result_df[result_df['count'] < days]
+
+    removed_stocks = list(result_df['stock'])
+
+    df1 = df1.drop(removed_stocks)
+    df2 = df2.drop(removed_stocks)
+    print("Stock number after trimming: ", len(df1.columns), len(df2.columns))
+
+    return df1, df2, removed_stocks
 
-        geometric_mean = (1 + daily_returns).prod()**(1 / len(daily_returns)) - 1
 
-        annualized_return = (1 + geometric_mean)**252 - 1
-        annualized_returns[stock] = annualized_return
+def select_lookback(df, start_date='2020-01-01', lookback_years=None):
+    # rows used for returns and volatilities: from start_date, or the last lookback_years years of the panel
+    if lookback_years is not None:
+        dates = pd.to_datetime(df['date'])
+        return df[dates >= dates.max() - pd.DateOffset(years=lookback_years)]
+    return df[df['date'] >= start_date]
 
-    return annualized_returns
+
+def calculate_daily_returns(stocks):
+    # returns between consecutive prices of every stock, skipping NaNs as dropna().pct_change() does per stock
+    prices = stocks.to_numpy(dtype=float)
+    previous_prices = pd.DataFrame(prices).ffill().shift().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return prices / previous_prices - 1
+
+
+def calculate_universe_statistics(df, start_date='2020-01-01', lookback_years=None, periods_per_year=252):
+    # data points (whole panel), annualized geometric return and annualized volatility (lookback window)
+    # for every stock at once, one row per stock
+    stocks = df.iloc[:, 1:]
+    daily_returns = calculate_daily_returns(select_lookback(df, start_date, lookback_years).iloc[:, 1:])
+    is_return = ~np.isnan(daily_returns)
+    number_of_returns = is_return.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        geometric_mean = np.where(is_return, 1 + daily_returns, 1.0).prod(axis=0)**(1 / number_of_returns) - 1
+        annualized_returns = np.where(number_of_returns > 0, (1 + geometric_mean)**periods_per_year - 1, np.nan)
+    annualized_volatilities = pd.DataFrame(daily_returns).std().to_numpy() * np.sqrt(periods_per_year)
+
+    return pd.DataFrame({
+        'data_points': stocks.count().to_numpy(),
+        'annualized_return': annualized_returns,
+        'annualized_volatility': annualized_volatilities,
+    }, index=stocks.columns)
+
+
+def calculate_annualized_volatilities(df, start_date='2020-01-01', lookback_years=None):
+    return calculate_universe_statistics(df, start_date, lookback_years)['annualized_volatility'].to_dict()
+
+
+def calculate_number_of_price_data_points(df):
+    return calculate_universe_statistics(df)['data_points'].to_dict()
+
+
+def calculate_annualized_returns(df, start_date='2020-01-01', lookback_years=None):
+    return calculate_universe_statistics(df, start_date, lookback_years)['annualized_return'].to_dict()
 
 
 def make_bins(data_dict):
 
-    values = list(data_dict.values())
-    mean = np.mean(values)
-    std = np.std(values)
-    
-    percentiles =  [percentileofscore(values, v, kind='rank') for v in values]
+    values = np.asarray(list(data_dict.values()), dtype=float)
+    n = len(values)
+
+    # percentileofscore(values, v, kind='rank') for every v from one sort; like scipy, a NaN makes every percentile NaN
+    if n == 0 or np.isnan(values).any():
+        percentiles = np.full(n, np.nan)
+    else:
+        sorted_values = np.sort(values)
+        left = np.searchsorted(sorted_values, values, side='left')
+        right = np.searchsorted(sorted_values, values, side='right')
+        percentiles = (left + right + (left < right)) * (50.0 / n)
+
     labels = ["Very Low", "Low", "Medium", "High", "Very High"]
     thresholds = [0, 5, 20, 80, 95, 100]
     
@@ -1,33 +1,102 @@
 import requests
 import string
 import time
+import os
+import gzip
+import json
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+import random
+import asyncio
+import aiohttp
+import nest_asyncio
 from ordered_set import OrderedSet
 import utils.db_funcs as db
+from utils.urls import url_hist_price_range, url_mcap_range
 import sqlite3
 import pandas as pd
 from dotenv import load_dotenv
 
 
-def get_data(url, api_key):
+cache_dir = "../http_cache"
+CACHE_MAX_AGE = 24 * 60 * 60    # seconds a cached response is served without asking FMP again; None = forever, 0 = always refetch
+
+# one keep-alive connection pool shared by all helpers instead of a new connection per request
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20))
+
+
+def cache_path(url):
+    # the api key is not part of the cache key, so a new key does not invalidate the cache
+    parts = urlsplit(url)
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k.lower() != "apikey"])
+    clean_url = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+    return os.path.join(cache_dir, hashlib.sha256(clean_url.encode()).hexdigest() + ".json.gz"), clean_url
+
+
+def read_cache(url, max_age=CACHE_MAX_AGE):
+    path, _ = cache_path(url)
+    if max_age == 0 or not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt") as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if max_age is not None and time.time() - entry["fetched_at"] > max_age:
+        return None
+    return entry["data"]
+
+
+def write_cache(url, data):
+    path, clean_url = cache_path(url)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt") as file:
+        json.dump({"url": clean_url, "fetched_at": time.time(), "data": data}, file)
+    os.replace(tmp_path, path)  # a crash mid-write never leaves a truncated entry
+
+
+def get_data(url, api_key, max_age=CACHE_MAX_AGE, max_retries=6, base_delay=1, max_delay=60):
+    # Same bounded retry and backoff as fetch_json: only 429 and 5xx answers and connection errors are retried,
+    # {} is returned for an error status or once the retries are exhausted (and is not cached).
     url = url.format(api_key = api_key)
-    response = requests.get(url, timeout = 20)
-    if response.status_code == 200:
-        data = response.json()
-
-        if len(data)>0: 
-            return data
-        else:
-            print(f"URL: {url}")
-            print(f"Length: {len(data)}")
-            print(f"No data found for {url}")
-            return {}
-    else:
-        print(f"Failed to fetch data. Status code: {response.status_code}")
-        print(f"Error: {response.text}")
-        time.sleep(60)
-        data = get_data(url, api_key)
-        print(data)
-        return data
+    cached = read_cache(url, max_age)
+    if cached is not None:
+        return cached
+
+    for attempt in range(max_retries + 1):
+        try:
+            response = http_session.get(url, timeout = 20)
+            if response.status_code == 200:
+                data = response.json()
+
+                if data is not None and len(data)>0: 
+                    write_cache(url, data)
+                    return data
+                else:
+                    print(f"No data found for {url.split('apikey=')[0]}")
+                    write_cache(url, {})
+                    return {}
+
+            print(f"Failed to fetch data. Status code: {response.status_code}")
+            print(f"Error: {response.text}")
+            if response.status_code not in RETRY_STATUSES:
+                return {}
+
+            retry_after = response.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff_delay(attempt, base_delay, max_delay)
+
+        except requests.RequestException as e:
+            print(f"Request error: {e!r}")
+            delay = backoff_delay(attempt, base_delay, max_delay)
+
+        if attempt < max_retries:
+            time.sleep(delay)
+
+    print(f"Giving up after {max_retries + 1} attempts: {url.split('apikey=')[0]}")
+    return {}
 
 
 def get_stocks(data):
@@ -71,6 +140,191 @@ def get_company_data(data):
         return [{field: item[field] for field in fields} for item in data]
 
 
+FMP_CALLS_PER_MINUTE = 300      # API plan limit, shared by all concurrent requests
+FMP_MAX_CONCURRENCY = 20        # open requests at any time
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    # Allows `rate` requests per second on average and bursts of up to `capacity` requests.
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt, base_delay=1, max_delay=60):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def fetch_json(session, url, api_key, bucket, max_retries=6, base_delay=1, max_delay=60, max_age=CACHE_MAX_AGE):
+    # Async get_data: {} for an empty answer, None for an error status (400/401/403/404, plan limits) or if all
+    # retries failed, so that the key is reported as failed and never recorded as done.
+    url = url.format(api_key = api_key)
+    cached = read_cache(url, max_age)
+    if cached is not None:
+        return cached
+
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    data = await response.json(content_type=None)
+                    data = data if data is not None and len(data) > 0 else {}
+                    write_cache(url, data)
+                    return data
+
+                if response.status not in RETRY_STATUSES:
+                    print(f"Failed to fetch data. Status code: {response.status}")
+                    print(f"Error: {await response.text()}")
+                    return None
+
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff_delay(attempt, base_delay, max_delay)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Request error: {e!r}")
+            delay = backoff_delay(attempt, base_delay, max_delay)
+
+        if attempt < max_retries:
+            await asyncio.sleep(delay)
+
+    print(f"Giving up after {max_retries + 1} attempts: {url.split('apikey=')[0]}")
+    return None
+
+
+def read_progress(progress_file):
+    if progress_file is None or not os.path.exists(progress_file):
+        return set()
+    with open(progress_file) as file:
+        return {line.strip() for line in file if line.strip()}
+
+
+async def fetch_all(urls, api_key, on_result=None, done_keys=None, progress_file=None,
+                    calls_per_minute=FMP_CALLS_PER_MINUTE, max_concurrency=FMP_MAX_CONCURRENCY,
+                    max_retries=6, timeout=20, max_age=CACHE_MAX_AGE):
+    # urls: {key: url or [urls]} e.g. {symbol: [url_mcap_24, url_mcap_19_24, url_mcap_14_19]}.
+    # on_result(key, data) is called as every key completes (data is a list for a list of urls), e.g. to write to SQLite.
+    # Keys in done_keys or in progress_file are skipped and finished keys are appended to progress_file,
+    # so an interrupted refresh resumes where it stopped. A key fails if any of its urls fails; failed keys are
+    # not passed to on_result nor written to progress_file, and are returned for a retry.
+    skip_keys = set(done_keys or ()) | read_progress(progress_file)
+    queue = asyncio.Queue()
+    for key, key_urls in urls.items():
+        if key not in skip_keys:
+            queue.put_nowait((key, key_urls))
+    print(f"Fetching {queue.qsize()} keys, {len(urls) - queue.qsize()} already done")
+
+    bucket = TokenBucket(calls_per_minute / 60)
+    failed_keys = []
+    results = {}
+    progress = open(progress_file, "a") if progress_file is not None else None
+
+    async def worker(session):
+        while True:
+            try:
+                key, key_urls = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            url_list = key_urls if isinstance(key_urls, list) else [key_urls]
+            data = [await fetch_json(session, url, api_key, bucket, max_retries, max_age=max_age) for url in url_list]
+
+            if any(item is None for item in data):
+                failed_keys.append(key)
+                continue
+
+            data = data if isinstance(key_urls, list) else data[0]
+            if on_result is not None:
+                on_result(key, data)
+            else:
+                results[key] = data
+            if progress is not None:
+                progress.write(f"{key}\n")
+                progress.flush()
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            await asyncio.gather(*[worker(session) for _ in range(max_concurrency)])
+    finally:
+        if progress is not None:
+            progress.close()
+
+    print(f"Fetched {len(urls) - len(skip_keys & set(urls)) - len(failed_keys)} keys, {len(failed_keys)} failed")
+    return results, failed_keys
+
+
+def fetch_all_blocking(*args, **kwargs):
+    # fetch_all for notebooks and scripts; nest_asyncio lets it run inside Jupyter's event loop
+    nest_asyncio.apply()
+    return asyncio.run(fetch_all(*args, **kwargs))
+
+
+def make_delta_urls(symbols, last_dates, url, start_date, end_date, max_years=None):
+    # {symbol: [urls]} covering the day after the last stored date (or start_date for new symbols) up to end_date,
+    # split into ranges of at most max_years years as the market cap endpoint caps the rows per call
+    end_date = pd.Timestamp(end_date).normalize()
+    urls = {}
+    for symbol in symbols:
+        last_date = last_dates.get(symbol)
+        from_date = pd.Timestamp(last_date) + pd.Timedelta(days=1) if last_date else pd.Timestamp(start_date)
+        if from_date > end_date:
+            continue
+
+        ranges = []
+        while from_date <= end_date:
+            to_date = min(end_date, from_date + pd.DateOffset(years=max_years)) if max_years else end_date
+            ranges.append((from_date, to_date))
+            from_date = to_date + pd.Timedelta(days=1)
+
+        urls[symbol] = [url.format(symbol=symbol, from_date=f"{a:%Y-%m-%d}", to_date=f"{b:%Y-%m-%d}", api_key="{api_key}") for a, b in ranges]
+    return urls
+
+
+def update_hist_prices(symbols, api_key, conn, start_date="2014-01-01", end_date=None, **fetch_kwargs):
+    # Incremental ingestion: extends every symbol in hist_prices with the dates after its last stored row
+    # and loads symbols without rows from start_date. Returns the symbols whose download failed.
+    end_date = end_date or pd.Timestamp.today()
+    last_dates = db.get_last_dates("hist_prices", conn)
+    urls = make_delta_urls(symbols, last_dates, url_hist_price_range, start_date, end_date)
+    print(f"Prices: {len(urls)} of {len(symbols)} symbols need new dates")
+
+    def store_prices(symbol, data):
+        records = [record for payload in data for record in (get_close_data(payload) or [])
+                   if record["date"] > last_dates.get(symbol, "")]
+        db.insert_hist_prices(records, conn)
+
+    _, failed_symbols = fetch_all_blocking(urls, api_key, on_result=store_prices, **fetch_kwargs)
+    return failed_symbols
+
+
+def update_hist_mcaps(symbols, api_key, conn, start_date="2014-01-01", end_date=None, **fetch_kwargs):
+    # Same as update_hist_prices for hist_mcaps, in ranges of at most 5 years per request
+    end_date = end_date or pd.Timestamp.today()
+    last_dates = db.get_last_dates("hist_mcaps", conn)
+    urls = make_delta_urls(symbols, last_dates, url_mcap_range, start_date, end_date, max_years=5)
+    print(f"Mcaps: {len(urls)} of {len(symbols)} symbols need new dates")
 
+    def store_mcaps(symbol, data):
+        records = [record for payload in data for record in (get_mcap_data(payload) or [])
+                   if record["date"] > last_dates.get(symbol, "")]
+        db.insert_hist_mcaps(records, conn)
 
-        
+    _, failed_symbols = fetch_all_blocking(urls, api_key, on_result=store_mcaps, **fetch_kwargs)
+    return failed_symbols
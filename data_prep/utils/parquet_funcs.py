@@ -0,0 +1,66 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+parquet_dir = "../files/parquet"
+CHUNK_ROWS = 1_000_000      # rows per Parquet file, bounds the memory of the export and of every read batch
+
+SCHEMAS = {
+    "hist_prices": pa.schema([("symbol", pa.string()), ("date", pa.int32()), ("close", pa.float64()), ("volume", pa.int64())]),
+    "hist_mcaps": pa.schema([("symbol", pa.string()), ("date", pa.int32()), ("mcap", pa.float64())]),
+}
+
+
+def export_hist_table(table_name, conn, out_dir=None, chunk_rows=CHUNK_ROWS):
+    # Streams a hist table out of SQLite in (symbol, date) order, the primary key order of the WITHOUT ROWID table,
+    # into one Parquet file per chunk. Each file covers a symbol range, so its min/max statistics prune files on symbol filters.
+    table_dir = os.path.join(out_dir or parquet_dir, table_name)
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.makedirs(table_dir)
+
+    schema = SCHEMAS[table_name]
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(schema.names)} FROM {table_name} ORDER BY symbol, date")
+
+    part, rows_written = 0, 0
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        pq.write_table(pa.Table.from_arrays(columns, schema=schema), os.path.join(table_dir, f"part-{part:05d}.parquet"))
+        part += 1
+        rows_written += len(rows)
+
+    print(f"{table_name}: {rows_written} rows exported to {part} Parquet files")
+    return table_dir
+
+
+def read_wide_panel(table_name, values, in_dir=None, batch_rows=CHUNK_ROWS):
+    # Builds the same wide frame as transpose_df(df, values) on the long table, without ever holding the long table:
+    # a first pass reads only symbol and date to size the panel, a second pass scatters one batch at a time into it.
+    dataset = ds.dataset(os.path.join(in_dir or parquet_dir, table_name), format="parquet")
+
+    symbols, dates = set(), set()
+    for batch in dataset.to_batches(columns=["symbol", "date"], batch_size=batch_rows):
+        symbols.update(pc.unique(batch.column("symbol")).to_pylist())
+        dates.update(np.unique(batch.column("date").to_numpy()).tolist())
+
+    symbols = np.array(sorted(symbols), dtype=object)
+    dates = np.array(sorted(dates, reverse=True), dtype=np.int64)   # newest first, as transpose_df sorts
+    panel = np.full((len(dates), len(symbols)), np.nan)
+
+    for batch in dataset.to_batches(columns=["symbol", "date", values], batch_size=batch_rows):
+        rows = len(dates) - 1 - np.searchsorted(dates[::-1], batch.column("date").to_numpy())
+        cols = np.searchsorted(symbols, batch.column("symbol").to_numpy(zero_copy_only=False))
+        panel[rows, cols] = batch.column(values).to_numpy(zero_copy_only=False)
+
+    df = pd.DataFrame(panel, columns=list(symbols))
+    df.insert(0, "date", [f"{d // 10000:04d}-{d // 100 % 100:02d}-{d % 100:02d}" for d in dates])
+    return df
@@ -12,4 +12,8 @@ url_hist_price = "https://financialmodelingprep.com/api/v3/historical-price-full
 
 url_mcap_24 =    "https://financialmodelingprep.com/api/v3/historical-market-capitalization/{symbol}?limit=10000&from=2024-01-01&to=2024-12-01&apikey={api_key}"
 url_mcap_19_24 = "https://financialmodelingprep.com/api/v3/historical-market-capitalization/{symbol}?limit=10000&from=2019-01-01&to=2024-01-01&apikey={api_key}"
-url_mcap_14_19 = "https://financialmodelingprep.com/api/v3/historical-market-capitalization/{symbol}?limit=10000&from=2014-01-01&to=2019-01-01&apikey={api_key}"
\ No newline at end of file
+url_mcap_14_19 = "https://financialmodelingprep.com/api/v3/historical-market-capitalization/{symbol}?limit=10000&from=2014-01-01&to=2019-01-01&apikey={api_key}"
+
+# date range templates for incremental updates, see fmp_funcs.update_hist_prices / update_hist_mcaps
+url_hist_price_range = "https://financialmodelingprep.com/api/v3/historical-price-full/{symbol}?from={from_date}&to={to_date}&apikey={api_key}"
+url_mcap_range = "https://financialmodelingprep.com/api/v3/historical-market-capitalization/{symbol}?limit=10000&from={from_date}&to={to_date}&apikey={api_key}"
@@ -1,7 +1,10 @@
+import hashlib
 import pandas as pd
+import numpy as np
 import warnings
 from .util_funcs import date_parser, transpose_weights
-from typing import Tuple, Dict, List, Union
+from .calendar_funcs import TradingCalendar, month_first_mask
+from typing import Tuple, Dict, List, Union, Optional
 
 
 def make_hyp_shares(prices: pd.DataFrame, 
@@ -39,37 +42,43 @@ def calc_mark_cap(prices: pd.DataFrame,
 
 def set_index_dates(price_dates: pd.DatetimeIndex, 
                     rebal_dates: List[pd.Timestamp],
-                    first_date: Union[str, pd.Timestamp, None] = None
+                    first_date: Union[str, pd.Timestamp, None] = None,
+                    calendar: Optional[TradingCalendar] = None
                     ) -> Tuple[pd.Timestamp, pd.DatetimeIndex, pd.Timestamp, pd.DatetimeIndex]:
     """
     Ensures the correct input for the first index date and returns:
     - first index date (if provided)
     - last rebalance date
     - all the dates from the last rebalance date onwards (Gross Index dates)
+    The calendar, if given, must hold the same dates as price_dates.
     """
 
+    if calendar is None:
+        calendar = TradingCalendar(price_dates)
+
     if first_date is not None:
         first_date = date_parser(first_date)
 
-    if first_date < price_dates[0]:
-        first_date = price_dates[0]
+    if first_date < calendar.dates[0]:
+        first_date = calendar.dates[0]
         #raise ValueError("The first index date is older than the first date in the price dataset")
 
-    if first_date not in price_dates:
+    if not calendar.contains([first_date])[0]:
         not_available_date = first_date
-        first_date = price_dates[price_dates < first_date].max()
+        first_date = calendar.last_before(first_date)
         warnings.warn(f"""
             There is no price data corresponding to the first date {not_available_date}.
             Using the first previous available date {first_date} as the index start date.
         """, UserWarning)
 
-    if min(rebal_dates) <= first_date <= max(rebal_dates):
-        last_rebal_date = max(date for date in rebal_dates if date <= first_date)
+    rebal_values = np.sort(pd.DatetimeIndex(rebal_dates).values)
+    if rebal_values[0] <= first_date <= rebal_values[-1]:
+        last_rebal_date = pd.Timestamp(rebal_values[np.searchsorted(rebal_values, first_date.to_datetime64(), side='right') - 1])
     else:
         last_rebal_date = first_date  # Default to `first_date` if no rebalance date is found
 
     # Find the index locations for slicing
-    last_rebal_date_loc = price_dates.get_loc(last_rebal_date)
+    last_rebal_date_loc = calendar.position(last_rebal_date)
 
     return (
         first_date,
@@ -161,6 +170,336 @@ def make_index_backtest(index_start_level: float,
     weights_data = (shares_data * prices).div(daily_total_market_value_list, axis=0)    
     weights_data_last_day = transpose_weights(weights_data)
     
-    index_series = index_series[index_series.index.is_month_start]
+    index_series = index_series[index_series.index.isin(gross_index_dates[month_first_mask(gross_index_dates)])]
    
-    return shares_data, weights_data, weights_data_last_day, index_series, prices
\ No newline at end of file
+    return shares_data, weights_data, weights_data_last_day, index_series, prices
+
+
+class SparseHoldings:
+    """
+    Constituents of a backtest held sparsely: for every rebalance segment (rows start:end of the price matrix)
+    the column positions of the held tickers and their hypothetical shares. Memory grows with the number of
+    held tickers, not with the universe, and dense (dates x tickers) frames are only built on request.
+    """
+
+    def __init__(self,
+                 tickers: List[str],
+                 dates: pd.DatetimeIndex,
+                 segment_starts: np.ndarray,
+                 active: List[np.ndarray],
+                 shares: List[np.ndarray]):
+        self.tickers = list(tickers)
+        self.dates = dates
+        self.segment_starts = np.asarray(segment_starts)
+        self.active = active
+        self.shares = shares
+
+    def segment_ends(self) -> np.ndarray:
+        return np.append(self.segment_starts[1:], len(self.dates))
+
+    def market_values(self, price_matrix: np.ndarray) -> np.ndarray:
+        """
+        Daily total market value, one product over the held columns per segment.
+        """
+        market_values = np.empty(len(self.dates))
+        for start, end, active, shares in zip(self.segment_starts, self.segment_ends(), self.active, self.shares):
+            market_values[start:end] = np.nan_to_num(price_matrix[start:end, active], nan=0.0) @ shares
+        return market_values
+
+    def last_shares(self) -> Dict[str, float]:
+        """
+        Hypothetical shares of the last segment, held tickers only.
+        """
+        return {self.tickers[position]: float(value) for position, value in zip(self.active[-1], self.shares[-1])}
+
+    def dense_shares(self) -> np.ndarray:
+        """
+        Materializes the (segments x tickers) share matrix.
+        """
+        segment_shares = np.zeros((len(self.segment_starts), len(self.tickers)))
+        for row, (active, shares) in enumerate(zip(self.active, self.shares)):
+            segment_shares[row, active] = shares
+        return segment_shares
+
+    def shares_frame(self) -> pd.DataFrame:
+        """
+        Materializes the daily (dates x tickers) shares, as shares_data of make_index_backtest.
+        """
+        segment_lengths = self.segment_ends() - self.segment_starts
+        return pd.DataFrame(np.repeat(self.dense_shares(), segment_lengths, axis=0), index = self.dates, columns=self.tickers)
+
+    def weights_frame(self,
+                      price_matrix: np.ndarray,
+                      market_values: np.ndarray) -> pd.DataFrame:
+        """
+        Materializes the daily (dates x tickers) weights, as weights_data of make_index_backtest.
+        """
+        return self.shares_frame() * price_matrix / market_values[:, None]
+
+
+def make_hyp_shares_array(prices_row: np.ndarray,
+                          weights_row: np.ndarray,
+                          market_cap: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array version of make_hyp_shares for one date: the column positions of the held tickers and their shares.
+    """
+    held = np.flatnonzero((prices_row > 0) & (weights_row > 0))  # NaN prices/weights compare False, same as make_hyp_shares
+    return held, (market_cap * weights_row[held]) / prices_row[held]
+
+
+def run_matrix_backtest(price_matrix: np.ndarray,
+                        rebal_locs: np.ndarray,
+                        rebal_weights: np.ndarray,
+                        initial_weights: Optional[np.ndarray] = None,
+                        initial_market_cap: Optional[float] = None,
+                        initial_shares: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Tuple[np.ndarray, List[np.ndarray], List[np.ndarray]]:
+    """
+    Core of the matrix engine. Shares are piecewise constant between rebalance dates, so each rebalance
+    only needs the prices of the held tickers. Returns the segment start rows and, per segment,
+    the held column positions and their shares.
+    With initial_shares (positions, shares) the run continues an existing backtest instead of buying the initial weights on the first row.
+    """
+    if initial_shares is None:
+        active, shares = make_hyp_shares_array(price_matrix[0], initial_weights, initial_market_cap)
+    else:
+        active, shares = initial_shares
+
+    segment_starts = [0]
+    segment_active = [active]
+    segment_shares = [shares]
+    for loc, weights_row in zip(rebal_locs, rebal_weights):
+        total_market_value = np.nan_to_num(price_matrix[loc, active], nan=0.0) @ shares
+        active, shares = make_hyp_shares_array(price_matrix[loc], weights_row, total_market_value)
+
+        if loc == segment_starts[-1]:
+            segment_active[-1], segment_shares[-1] = active, shares
+        else:
+            segment_starts.append(loc)
+            segment_active.append(active)
+            segment_shares.append(shares)
+
+    return np.array(segment_starts), segment_active, segment_shares
+
+
+def make_index_holdings(index_start_level: float,
+                        initial_divisor: float,
+                        weights: pd.DataFrame,
+                        prices: pd.DataFrame,
+                        rebalance_dates: List[pd.Timestamp],
+                        first_index_date: Union[str, pd.Timestamp, None] = None,
+                        calendar: Optional[TradingCalendar] = None,
+                        verbose: bool = True
+                        ) -> Tuple[SparseHoldings, pd.Series, pd.Timestamp, pd.DataFrame]:
+    """
+    Runs the matrix engine without building any (dates x tickers) frame. Returns the sparse holdings,
+    the daily index level (market value / divisor, not rebased), the first index date and the prices from the start of the backtest.
+    verbose=False silences the per-rebalancing messages.
+    """
+    initial_market_cap = index_start_level * initial_divisor
+
+    first_index_date, last_rebalancing_date, gross_index_dates  =  set_index_dates(prices.index, rebalance_dates, first_index_date, calendar)
+    initial_weights  =                                             set_inital_weights(first_index_date, weights)
+
+    prices = prices[prices.index >= last_rebalancing_date]  # this allows for setting the custom index start date
+    price_matrix = prices.to_numpy(dtype=float)
+    weights = weights.reindex(columns=prices.columns)
+    initial_weights = np.nan_to_num(initial_weights.reindex(prices.columns).to_numpy(dtype=float))
+
+    rebal_locs = np.flatnonzero(gross_index_dates.isin(rebalance_dates))
+    if verbose:
+        for date in gross_index_dates[rebal_locs]:
+            print(f"Rebalancing on {date}")
+    rebal_weights = np.nan_to_num(weights.loc[gross_index_dates[rebal_locs]].to_numpy(dtype=float))
+
+    segment_starts, segment_active, segment_shares = run_matrix_backtest(price_matrix, rebal_locs, rebal_weights,
+                                                                         initial_weights, initial_market_cap)
+    holdings = SparseHoldings(prices.columns, gross_index_dates, segment_starts, segment_active, segment_shares)
+    levels = pd.Series(holdings.market_values(price_matrix) / initial_divisor, index = gross_index_dates, name="Index Level")
+
+    return holdings, levels, first_index_date, prices
+
+
+def make_index_backtest_matrix(index_start_level: float,
+               initial_divisor: float,
+               weights: pd.DataFrame,
+               prices: pd.DataFrame,
+               rebalance_dates: List[pd.Timestamp],
+               first_index_date: Union[str, pd.Timestamp, None] = None,
+               calendar: Optional[TradingCalendar] = None
+               ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.DataFrame]:
+    """
+    NumPy implementation of make_index_backtest with the same inputs and outputs.
+    The optional calendar must hold the dates of the prices index.
+    """
+    holdings, index_series, first_index_date, prices = make_index_holdings(index_start_level, initial_divisor, weights, prices,
+                                                                           rebalance_dates, first_index_date, calendar)
+
+    if first_index_date is not None:
+        filtered = index_series.loc[first_index_date:]
+        index_series = index_start_level * (filtered / filtered.iloc[0])
+
+    # Dense shares and weights are materialized for the outputs of make_index_backtest only
+    price_matrix = prices.to_numpy(dtype=float)
+    shares_data = holdings.shares_frame()
+    weights_data = holdings.weights_frame(price_matrix, holdings.market_values(price_matrix))
+    weights_data_last_day = transpose_weights(weights_data)
+
+    index_series = index_series[index_series.index.isin(holdings.dates[month_first_mask(holdings.dates)])]
+
+    return shares_data, weights_data, weights_data_last_day, index_series, prices
+
+
+def rebase_index_series(levels: pd.Series,
+                        index_start_level: float,
+                        start_date: Union[str, pd.Timestamp, None] = None,
+                        end_date: Union[str, pd.Timestamp, None] = None,
+                        month_start: bool = True) -> pd.Series:
+    """
+    Answers any date range from the full-history level series: slices it from start_date to end_date and
+    rebases it to index_start_level on the start date, level / level[start] * index_start_level.
+    As in set_index_dates, a start date without prices falls back to the previous available date and a
+    start before the history to its first date. Returns the levels on the first trading day of every month,
+    like make_index_backtest, or all daily levels with month_start=False.
+    """
+    start_loc = 0
+    if start_date is not None:
+        start_loc = max(levels.index.searchsorted(date_parser(start_date), side='right') - 1, 0)
+
+    end_loc = len(levels)
+    if end_date is not None:
+        end_loc = levels.index.searchsorted(date_parser(end_date), side='right')
+
+    window = levels.iloc[start_loc:end_loc]
+    if window.empty:
+        raise ValueError(f"No index levels between {start_date} and {end_date}")
+
+    index_series = index_start_level * (window / window.iloc[0])
+    if not month_start:
+        return index_series
+    return index_series[index_series.index.isin(levels.index[month_first_mask(levels.index)])]
+
+
+def calculate_index_statistics(index_series: pd.Series) -> Dict[str, float]:
+    """
+    Summary statistics of a daily index level series: total and annualized return, annualized volatility
+    of the daily log returns and maximum drawdown. Years are measured in calendar time.
+    """
+    levels = index_series.to_numpy(dtype=float)
+    years = (index_series.index[-1] - index_series.index[0]).days / 365.25
+    log_returns = np.diff(np.log(levels))
+    periods_per_year = len(log_returns) / years if years > 0 else np.nan
+
+    return {
+        'total_return': levels[-1] / levels[0] - 1,
+        'annualized_return': (levels[-1] / levels[0]) ** (1 / years) - 1 if years > 0 else np.nan,
+        'annualized_volatility': log_returns.std(ddof=1) * np.sqrt(periods_per_year) if len(log_returns) > 1 else np.nan,
+        'max_drawdown': (levels / np.maximum.accumulate(levels) - 1).min(),
+    }
+
+
+def hash_past_weights(weights: pd.DataFrame,
+                      tickers: List[str],
+                      rebalance_dates: List[pd.Timestamp],
+                      last_date: pd.Timestamp) -> str:
+    """
+    Hash of the weight rows solved on the rebalance dates up to last_date, used to detect revised past selections.
+    """
+    past_dates = [date for date in rebalance_dates if date <= last_date]
+    weight_matrix = np.nan_to_num(weights.reindex(columns=tickers).loc[past_dates].to_numpy(dtype=float))
+    return hashlib.sha1(np.ascontiguousarray(weight_matrix).tobytes()).hexdigest()
+
+
+def make_index_state(holdings: SparseHoldings,
+                     levels: pd.Series,
+                     weights: pd.DataFrame,
+                     prices: pd.DataFrame,
+                     rebalance_dates: List[pd.Timestamp],
+                     divisor: float) -> dict:
+    """
+    Collects what extend_index_backtest needs to continue a finished full-history backtest: the divisor,
+    the hypothetical shares of the held tickers, the last rebalance date, the last level and the daily level series.
+    The last prices, the calendar version and a hash of the past weights are kept to detect revised history.
+    """
+    past_rebalance_dates = [date for date in rebalance_dates if date <= prices.index[-1]]
+
+    return {
+        'tickers': prices.columns.tolist(),
+        'divisor': divisor,
+        'shares': holdings.last_shares(),
+        'first_date': prices.index[0],
+        'last_date': prices.index[-1],
+        'last_prices': prices.iloc[-1].to_numpy(dtype=float),
+        'last_rebalance_date': max(past_rebalance_dates) if past_rebalance_dates else prices.index[0],
+        'last_level': float(levels.iloc[-1]),
+        'rebalance_dates': past_rebalance_dates,
+        'weights_hash': hash_past_weights(weights, prices.columns.tolist(), past_rebalance_dates, prices.index[-1]),
+        'calendar_version': TradingCalendar(prices.index).version,
+        'levels': levels,
+    }
+
+
+def index_state_matches(state: dict,
+                        weights: pd.DataFrame,
+                        prices: pd.DataFrame,
+                        rebalance_dates: List[pd.Timestamp]) -> bool:
+    """
+    Checks that the history behind a stored state is unchanged: same tickers, calendar, rebalance dates,
+    weights on those dates and last prices. Returns False if the state cannot be extended and the index must be rebuilt.
+    """
+    last_date = state['last_date']
+    if prices.columns.tolist() != state['tickers'] or last_date not in prices.index:
+        return False
+
+    past_dates = prices.index[(prices.index >= state['first_date']) & (prices.index <= last_date)]
+    if TradingCalendar(past_dates).version != state['calendar_version']:
+        return False
+
+    if [date for date in rebalance_dates if date <= last_date] != state['rebalance_dates']:
+        return False
+
+    if hash_past_weights(weights, state['tickers'], state['rebalance_dates'], last_date) != state.get('weights_hash'):
+        return False
+
+    return np.allclose(prices.loc[last_date].to_numpy(dtype=float), state['last_prices'], rtol=1e-12, atol=0, equal_nan=True)
+
+
+def extend_index_backtest(state: dict,
+                          weights: pd.DataFrame,
+                          prices: pd.DataFrame,
+                          rebalance_dates: List[pd.Timestamp]) -> Tuple[pd.Series, dict]:
+    """
+    Extends a stored backtest by the trading days after state['last_date'], rebalancing only on new
+    rebalance dates. The work is proportional to the number of new days. Returns the daily levels and the new state.
+    """
+    tickers = state['tickers']
+    new_prices = prices.loc[prices.index > state['last_date'], tickers]
+    if new_prices.empty:
+        return state['levels'], state
+
+    price_matrix = new_prices.to_numpy(dtype=float)
+    rebal_locs = np.flatnonzero(new_prices.index.isin(rebalance_dates))
+    for date in new_prices.index[rebal_locs]:
+        print(f"Rebalancing on {date}")
+    rebal_weights = np.nan_to_num(weights.reindex(columns=tickers).loc[new_prices.index[rebal_locs]].to_numpy(dtype=float))
+
+    ticker_position = {ticker: position for position, ticker in enumerate(tickers)}
+    initial_shares = (np.array([ticker_position[ticker] for ticker in state['shares']], dtype=int),
+                      np.array(list(state['shares'].values()), dtype=float))
+    segment_starts, segment_active, segment_shares = run_matrix_backtest(price_matrix, rebal_locs, rebal_weights, initial_shares=initial_shares)
+    holdings = SparseHoldings(tickers, new_prices.index, segment_starts, segment_active, segment_shares)
+
+    new_levels = pd.Series(holdings.market_values(price_matrix) / state['divisor'], index = new_prices.index, name="Index Level")
+    levels = pd.concat([state['levels'], new_levels])
+
+    new_rebalance_dates = list(new_prices.index[rebal_locs])
+    new_state = dict(state,
+                     shares=holdings.last_shares(),
+                     last_date=new_prices.index[-1],
+                     last_prices=price_matrix[-1],
+                     last_rebalance_date=new_rebalance_dates[-1] if new_rebalance_dates else state['last_rebalance_date'],
+                     last_level=float(new_levels.iloc[-1]),
+                     rebalance_dates=state['rebalance_dates'] + new_rebalance_dates,
+                     weights_hash=hash_past_weights(weights, tickers, state['rebalance_dates'] + new_rebalance_dates, new_prices.index[-1]),
+                     calendar_version=TradingCalendar(levels.index).version,
+                     levels=levels)
+    return levels, new_state
@@ -0,0 +1,132 @@
+import os
+import copy
+import json
+import pickle
+import sqlite3
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from .inputs import result_cache_size
+
+
+logger = logging.getLogger(__name__)
+
+_result_cache: "OrderedDict[str, Any]" = OrderedDict()  # result key -> index result, least recently used first
+
+
+def get_data_version(*file_paths: str) -> str:
+    """
+    Returns a short hash of the path, mtime and size of the data files, which changes with every data build.
+    """
+    stats = [(path, os.path.getmtime(path), os.path.getsize(path)) for path in file_paths]
+    return hashlib.sha256(json.dumps(stats).encode()).hexdigest()[:16]
+
+
+def make_result_key(tickers: List[str],
+                    params: Dict[str, Any],
+                    data_version: str) -> str:
+    """
+    Builds the cache key from the sorted ticker set, the index parameters and the data version.
+    """
+    payload = {'tickers': sorted(set(tickers)), 'params': params, 'data_version': data_version}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_cached_result(key: str,
+                      db_path: Optional[str] = None) -> Optional[Any]:
+    """
+    Looks the key up in the in-memory LRU first and then, if a db_path is given, in the SQLite tier.
+    """
+    if key in _result_cache:
+        _result_cache.move_to_end(key)
+        logger.info(f"RESULT CACHE - MEMORY HIT: {key[:12]}")
+        return copy.deepcopy(_result_cache[key])  # callers get their own copy
+
+    if db_path is not None and os.path.exists(db_path):
+        with sqlite3.connect(db_path) as conn:
+            _create_results_table(conn)
+            row = conn.execute("SELECT payload FROM index_results WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            logger.info(f"RESULT CACHE - DISK HIT: {key[:12]}")
+            result = pickle.loads(row[0])
+            _store_in_memory(key, result)
+            return copy.deepcopy(result)
+
+    logger.info(f"RESULT CACHE - MISS: {key[:12]}")
+    return None
+
+
+def put_cached_result(key: str,
+                      result: Any,
+                      db_path: Optional[str] = None) -> None:
+    """
+    Stores a result in the in-memory LRU (evicting the oldest entries above result_cache_size) and optionally in SQLite.
+    """
+    _store_in_memory(key, copy.deepcopy(result))
+
+    if db_path is not None:
+        with sqlite3.connect(db_path) as conn:
+            _create_results_table(conn)
+            conn.execute("INSERT OR REPLACE INTO index_results (key, payload) VALUES (?, ?)",
+                         (key, pickle.dumps(result)))
+
+
+def clear_result_cache() -> None:
+    """
+    Empties the in-memory tier. The SQLite tier is keyed by data version and does not need clearing.
+    """
+    _result_cache.clear()
+
+
+def get_index_state(key: str,
+                    db_path: str) -> Optional[dict]:
+    """
+    Returns the persisted backtest state of an index (see make_index_state), or None.
+    """
+    if not os.path.exists(db_path):
+        return None
+
+    with sqlite3.connect(db_path) as conn:
+        _create_states_table(conn)
+        row = conn.execute("SELECT payload FROM index_states WHERE key = ?", (key,)).fetchone()
+    return pickle.loads(row[0]) if row is not None else None
+
+
+def put_index_state(key: str,
+                    state: dict,
+                    db_path: str) -> None:
+    """
+    Persists the backtest state of an index, replacing the previous one.
+    """
+    with sqlite3.connect(db_path) as conn:
+        _create_states_table(conn)
+        conn.execute("INSERT OR REPLACE INTO index_states (key, payload) VALUES (?, ?)",
+                     (key, pickle.dumps(state)))
+
+
+def _store_in_memory(key: str,
+                     result: Any) -> None:
+    _result_cache[key] = result
+    _result_cache.move_to_end(key)
+    while len(_result_cache) > result_cache_size:
+        evicted_key, _ = _result_cache.popitem(last=False)
+        logger.info(f"RESULT CACHE - EVICTED: {evicted_key[:12]}")
+
+
+def _create_results_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS index_results (
+        key TEXT PRIMARY KEY,
+        payload BLOB NOT NULL
+    )
+    """)
+
+
+def _create_states_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS index_states (
+        key TEXT PRIMARY KEY,
+        payload BLOB NOT NULL
+    )
+    """)
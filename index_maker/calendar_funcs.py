@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+_schedule_cache: Dict[Tuple, Dict[Any, pd.DatetimeIndex]] = {}  # (calendar version, weekday, scenarios) -> schedules
+
+
+class TradingCalendar:
+    """
+    Sorted, unique trading dates of a panel held as a datetime64 array.
+    Built once per request and shared by filter_mcap, get_rebalance_dates, prepare_for_index
+    and set_index_dates, so that every date lookup is a binary search instead of a scan.
+    """
+
+    def __init__(self, dates: Any):
+        name = getattr(dates, 'name', None)
+        self.values = np.unique(pd.DatetimeIndex(dates).normalize().values)
+        self.dates = pd.DatetimeIndex(self.values, name=name)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, date_column: str = 'Date') -> 'TradingCalendar':
+        return cls(df[date_column])
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def version(self) -> str:
+        """
+        Hash of the calendar dates; it changes whenever the data build adds or removes dates.
+        """
+        return hashlib.sha1(self.values.view(np.int64).tobytes()).hexdigest()
+
+    def contains(self, dates: Any) -> np.ndarray:
+        """
+        Returns a boolean array telling which of the given dates are trading dates.
+        """
+        targets = _as_datetime64(dates)
+        positions = np.searchsorted(self.values, targets, side='left')
+        found = positions < len(self.values)
+        found[found] = self.values[positions[found]] == targets[found]
+        return found
+
+    def position(self, date: Any) -> int:
+        """
+        Returns the row position of a trading date, raising a KeyError if it is not in the calendar.
+        """
+        if not self.contains([date])[0]:
+            raise KeyError(date)
+        return int(np.searchsorted(self.values, _as_datetime64([date])[0], side='left'))
+
+    def next_on_or_after(self, dates: Any) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        """
+        Resolves every given date to the first trading date on or after it.
+        Returns the resolved dates and a mask of the inputs that could be resolved.
+        """
+        positions = np.searchsorted(self.values, _as_datetime64(dates), side='left')
+        found = positions < len(self.values)
+        return pd.DatetimeIndex(self.values[positions[found]]), found
+
+    def last_before(self, date: Any) -> Optional[pd.Timestamp]:
+        """
+        Returns the last trading date strictly before the given date, or None.
+        """
+        position = np.searchsorted(self.values, _as_datetime64([date])[0], side='left')
+        return pd.Timestamp(self.values[position - 1]) if position > 0 else None
+
+    def since(self, date: Any) -> 'TradingCalendar':
+        """
+        Returns the part of the calendar from the given date onwards.
+        """
+        position = np.searchsorted(self.values, _as_datetime64([date])[0], side='left')
+        return TradingCalendar(self.dates[position:])
+
+    def nth_weekday_dates(self,
+                          weekday: int,
+                          position: int,
+                          months: Optional[List[int]] = None,
+                          period: str = 'M') -> pd.DatetimeIndex:
+        """
+        Returns the given weekday at a position within every month ('M') or quarter ('Q') of the calendar,
+        optionally restricted to the given months. Positions follow groupby().nth(): 0-based, negative from the end.
+        """
+        weekday_dates = self.dates[self.dates.weekday == weekday]
+        if months is not None:
+            weekday_dates = weekday_dates[weekday_dates.month.isin(months)]
+
+        if period == 'M':
+            period_keys = weekday_dates.year * 12 + weekday_dates.month
+        elif period == 'Q':
+            period_keys = weekday_dates.year * 4 + weekday_dates.quarter
+        else:
+            raise ValueError(f"Invalid period {period}, use 'M' or 'Q'")
+
+        _, period_start, period_inverse, period_count = np.unique(period_keys, return_index=True, return_inverse=True, return_counts=True)
+        rank_in_period = np.arange(len(weekday_dates)) - period_start[period_inverse]
+
+        target_rank = position if position >= 0 else period_count[period_inverse] + position
+        return weekday_dates[rank_in_period == target_rank]
+
+
+def build_selection_schedules(calendar: TradingCalendar,
+                              weekday: int,
+                              scenarios: Dict[Any, dict]) -> Dict[Any, pd.DatetimeIndex]:
+    """
+    Computes the selection dates of every scenario: the nth weekday of every month ('M'),
+    of every quarter ('Q') or of the listed months ('Semi-Annual').
+    A positive nth_friday counts from the start of the period (1 is the first weekday), a negative one
+    from its end (-1 is the last weekday).
+    """
+    schedules = {}
+    for scenario, params in scenarios.items():
+        nth_friday = params['nth_friday']
+        position = nth_friday - 1 if nth_friday > 0 else nth_friday
+        frequency = params['frequency']
+
+        if frequency == 'M':
+            schedules[scenario] = calendar.nth_weekday_dates(weekday, position, period='M')
+        elif frequency == 'Q':
+            schedules[scenario] = calendar.nth_weekday_dates(weekday, position, period='Q')
+        elif frequency == 'Semi-Annual':
+            schedules[scenario] = calendar.nth_weekday_dates(weekday, position, months=params['months'], period='M')
+        else:
+            raise ValueError(f"Invalid frequency {frequency} in scenario {scenario}, check the Scenarios dictionary")
+
+    return schedules
+
+
+def get_selection_dates(calendar: TradingCalendar,
+                        scenario: Any,
+                        weekday: int,
+                        scenarios: Dict[Any, dict]) -> pd.DatetimeIndex:
+    """
+    Returns the selection dates of one scenario. The schedules of all scenarios are computed on the
+    first call for a calendar version and weekday, after that this is a dictionary lookup.
+    """
+    scenarios_key = tuple(sorted(
+        (str(key), params['nth_friday'], params['frequency'], tuple(params.get('months') or ()))
+        for key, params in scenarios.items()
+    ))
+    cache_key = (calendar.version, weekday, scenarios_key)
+
+    if cache_key not in _schedule_cache:
+        _schedule_cache[cache_key] = build_selection_schedules(calendar, weekday, scenarios)
+        logger.info(f"REBALANCE CALENDAR - SCHEDULES BUILT FOR {len(scenarios)} SCENARIOS")
+
+    return _schedule_cache[cache_key][scenario]
+
+
+def month_first_mask(dates: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Marks the first date of every month in a sorted DatetimeIndex: is_month_start for trading calendars,
+    where the 1st is often not a trading day. The first date of the index only counts if it is the 1st,
+    since its month may be incomplete. On a calendar-day grid this equals is_month_start.
+    """
+    months = dates.year * 12 + dates.month
+    mask = np.ones(len(dates), dtype=bool)
+    mask[1:] = months[1:] != months[:-1]
+    if len(dates):
+        mask[0] = dates[0].day == 1
+    return mask
+
+
+def _as_datetime64(dates: Any) -> np.ndarray:
+    return pd.DatetimeIndex(dates).normalize().values
@@ -2,7 +2,11 @@ import pandas as pd
 pd.set_option('display.max_rows', None)
 import pickle
 import os
+import re
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import set_key, load_dotenv
 
 import matplotlib
@@ -10,7 +14,7 @@ matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
 from datetime import datetime, timedelta
-from typing import Tuple, List, Union, Optional
+from typing import Dict, Tuple, List, Union, Optional
 from pytz import timezone
 from dotenv import load_dotenv
 
@@ -18,6 +22,9 @@ from .util_funcs import *
 from .price_funcs import *
 from .reweight_funcs import *
 from .backtesting_funcs import *
+from .store_funcs import *
+from .cache_funcs import *
+from .sweep_funcs import make_param_grid, run_parameter_sweep
 
 
 logging.basicConfig(
@@ -32,13 +39,28 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(script_dir)
 price_file_path = os.path.join(parent_dir, 'files', 'prices_trimmed.pkl')
 mcaps_file_path = os.path.join(parent_dir, 'files', 'mcaps_trimmed.pkl')
+price_store_path = os.path.join(parent_dir, 'files', 'prices_trimmed.arrow')
+mcaps_store_path = os.path.join(parent_dir, 'files', 'mcaps_trimmed.arrow')
+result_db_path = os.path.join(parent_dir, 'files', 'index_results.db')
 env_file_path = os.path.join(parent_dir, '.env')
 #logger.info(f"Script directores: {env_file_path}")
 
+def make_index_tool(ticker_input: Optional[str] = None, _input=None,
+                    start_date: Optional[str] = None,
+                    end_date: Optional[str] = None) -> str:
+    """
+    Index tool of the agent. start_date/end_date are the range of the API request; without them
+    the dates the LLM put in the tool input (see split_date_range) are used.
+    """
+    input_start_date, input_end_date = None, None
+    if ticker_input:
+        ticker_input, input_start_date, input_end_date = split_date_range(ticker_input)
 
+    if start_date or end_date:
+        logger.info(f"MAKE INDEX TOOL - DATE RANGE RECEIVED WITH THE REQUEST: {[start_date, end_date]}")
+    else:
+        start_date, end_date = input_start_date, input_end_date
 
-def make_index_tool(ticker_input: Optional[str] = None, _input=None,) -> str:
-    
     if ticker_input != "default" and ticker_input != "" and ticker_input is not None: 
         logger.info(f"MAKE INDEX TOOL - TICKERS RECEIVED AS ARGUMENT: {ticker_input}")
         ticker_list = [ticker.strip().upper() for ticker in ticker_input.split(",")]
@@ -51,80 +73,373 @@ def make_index_tool(ticker_input: Optional[str] = None, _input=None,) -> str:
             ticker_list = ticker_str.split(",") if ticker_str else []
             logger.info(f"MAKE INDEX TOOL - FORWARDING EXISTING .ENV TICKERS {ticker_list}")
 
-    return make_index(ticker_list)
+    return make_index(ticker_list, start_date, end_date)
 
 
-def make_index(ticker_list): 
-   
-    with open(price_file_path, 'rb') as file:
-        prices_trimmed = pickle.load(file)
+def split_date_range(ticker_input: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Separates an optional date range from the tool input, e.g. "AAPL, MSFT, 2020-01-01, 2023-12-31".
+    The first YYYY-MM-DD item is the start date and the second one the end date.
+    """
+    items = [item.strip() for item in ticker_input.split(",")]
+    dates = [item for item in items if re.fullmatch(r"\d{4}-\d{2}-\d{2}", item)]
+    tickers = ",".join(item for item in items if item and item not in dates)
+
+    if dates:
+        logger.info(f"MAKE INDEX TOOL - DATE RANGE RECEIVED AS ARGUMENT: {dates[:2]}")
+    return tickers, (dates[0] if dates else None), (dates[1] if len(dates) > 1 else None)
 
-    with open(mcaps_file_path, 'rb') as file:
-        mcaps_trimmed = pickle.load(file)
 
-    all_ticker_list = list(prices_trimmed.columns)
+def make_index(ticker_list: List[str],
+               start_date: Union[str, pd.Timestamp, None] = None,
+               end_date: Union[str, pd.Timestamp, None] = None): 
+    """
+    Builds (or takes from the cache) the full-history daily levels of the basket and answers the requested
+    date range by rebasing them. start_date defaults to inputs.first_index_date, end_date to the last price date.
+    Returns (index series of the first calculated type of index_type_list, available tickers text,
+    removed tickers text, {every other calculated index type: index series}).
+    """
+   
+    ensure_panel_store(price_file_path, price_store_path)  # converts the pickles once per data build
+    ensure_panel_store(mcaps_file_path, mcaps_store_path)
+
+    all_ticker_list = read_panel_columns(price_store_path)
     removed_tickers = [item for item in ticker_list if item not in all_ticker_list]
     ticker_list = [item for item in ticker_list if item in all_ticker_list]
 
     if removed_tickers:
         logger.info(f"MAKE INDEX - TICKERS NOT FOUND: {removed_tickers}")
-    
-    prices_trimmed.rename(columns={'date': 'Date'}, inplace=True)
-    mcaps_trimmed.rename(columns={'date': 'Date'}, inplace=True)
+
+    adj_prices_df = read_panel(price_store_path, ticker_list).rename(columns={'date': 'Date'})
+    mcap_df = read_panel(mcaps_store_path, ticker_list).rename(columns={'date': 'Date'})
 
     from .inputs import (
         file_path, mcap_threshold, max_cap_value, min_cap_value, scenario,
-        date_adjustment_days, first_index_date, index_start_level,
+        date_adjustment_days, first_index_date, index_start_level, top_n,
         initial_divisor, index_type_list, save_results,
-        ignore_past_dividends, parent_dir
+        ignore_past_dividends, parent_dir, result_cache_on_disk, incremental_updates
     )
 
     ticker_list.insert(0, 'Date')
+    data_version = get_data_version(price_store_path, mcaps_store_path)
+    cache_db_path = result_db_path if result_cache_on_disk else None
+    logger.info(f"MAKE INDEX - FUNCTION INPUT {ticker_list}")
 
-    prices_selected = prices_trimmed.copy()
-    mcaps_selected = mcaps_trimmed.copy()
+    index_levels_by_type = {}
+    result_keys = {}
+    state_keys = {}
+    for index_type in index_type_list:
+        result_keys[index_type] = make_result_key(ticker_list[1:], make_result_params(index_type), data_version)
+        state_keys[index_type] = make_result_key(ticker_list[1:], make_result_params(index_type), 'index_state')  # states outlive data versions
+        cached_levels = get_cached_result(result_keys[index_type], cache_db_path)
+        if cached_levels is not None:
+            index_levels_by_type[index_type] = cached_levels
 
-    adj_prices_df = prices_selected[ticker_list]
-    mcap_df= mcaps_selected[ticker_list]
+    pending_types = [index_type for index_type in index_type_list if index_type not in index_levels_by_type]
 
-    for index_type in index_type_list:
-        logger.info(f"MAKE INDEX - FUNCTION INPUT {ticker_list}")
-        
-        #mcap_df, prices_df, divs_df, country_df, tax_df = read_mcap_and_prices(file_path)
-        #adj_prices_df = adjust_prices(prices_df, divs_df, country_df, tax_df, ignore_past_dividends, first_index_date, index_type = index_type)
-        
-        mcap_filter_df = filter_mcap(scenario=scenario, weekday = 4, df=mcap_df)
-        selection_dates_list, rebalance_dates_list = get_rebalance_dates(mcap_filter_df, adj_prices_df, offset_days = date_adjustment_days)
+    if pending_types:
+        calendar = TradingCalendar.from_frame(adj_prices_df)
+        mcap_filter_df = filter_mcap(scenario=scenario, weekday = 4, df=mcap_df, calendar=calendar)
+        selection_dates_list, rebalance_dates_list = get_rebalance_dates(mcap_filter_df, adj_prices_df, offset_days = date_adjustment_days, calendar=calendar)
         mcap_filter_df = mcap_filter_df[mcap_filter_df['Date'].isin(selection_dates_list)] # Market cap only includes the reweighting dates
-        
+
         tickers = mcap_df.columns[1:].tolist() # get the list of all companies, before filtering
-        mcap_weights_df = calculate_weights(mcap_filter_df, rebalance_dates_list, mcap_threshold, max_cap_value, min_cap_value, tickers)
-        weights, prices, rebalance_dates =  prepare_for_index(mcap_weights_df, adj_prices_df)
-
-        shares_data, weights_data, weights_data_last_day, index_series, prices_data = make_index_backtest(index_start_level = index_start_level, 
-                                                                initial_divisor = initial_divisor, 
-                                                                weights = weights, 
-                                                                prices = prices, 
-                                                                rebalance_dates = rebalance_dates,
-                                                                first_index_date = first_index_date)
-        
-
-        if "Date" in ticker_list:
-            ticker_list.remove("Date")
-        ticker_str = ",".join(ticker_list)
-        set_key(env_file_path, "TICKERS", ticker_str)
-        logger.info(f"MAKE INDEX - QUERY TICKERS SAVED TO GLOBAL ENV: {ticker_str}")
-        #plot_index(series = index_series, index_type = index_type)
-
-        if len(ticker_list)>0:
-            text_avalable_tickers = f"Please find below the historical index performance for following tickers: {', '.join(ticker_list)}"
-        else:
-            text_removed_tickers = ""
-
-        if len(removed_tickers)>0:
-            text_removed_tickers = f"Following tickers in your request were not found: {', '.join(removed_tickers)}"
-        else:
-            text_removed_tickers = ""
-
-
-        return  index_series.to_dict(), text_avalable_tickers, text_removed_tickers
+        mcap_ranking = get_mcap_ranking(mcap_filter_df, tickers, data_version, (scenario, date_adjustment_days))
+        mcap_weights_df = calculate_weights_matrix(mcap_filter_df, rebalance_dates_list, mcap_threshold, max_cap_value, min_cap_value, tickers,
+                                                   top_n=top_n, ranking=mcap_ranking)
+
+        needs_dividends = any(index_type != 'PR' for index_type in pending_types)
+        index_states = {index_type: get_index_state(state_keys[index_type], result_db_path) for index_type in pending_types} if incremental_updates else {}
+        computed_series = run_index_types(pending_types, {
+            'prices_df': adj_prices_df,
+            'price_store_path': price_store_path,
+            'weights_df': mcap_weights_df,
+            'calendar': calendar,
+            'dividend_inputs': load_dividend_inputs(file_path, adj_prices_df) if needs_dividends else None,
+            'index_states': index_states,
+        })
+
+        for index_type, (index_levels, index_state) in computed_series.items():
+            put_cached_result(result_keys[index_type], index_levels, cache_db_path)
+            if incremental_updates:
+                put_index_state(state_keys[index_type], index_state, result_db_path)
+            index_levels_by_type[index_type] = index_levels
+
+    if start_date is None:
+        start_date = first_index_date
+    index_series_by_type = {index_type: rebase_index_series(index_levels_by_type[index_type], index_start_level, start_date, end_date).to_dict()
+                            for index_type in index_type_list if index_type in index_levels_by_type}
+    if not index_series_by_type:
+        raise ValueError(f"None of the index types {index_type_list} could be calculated")
+    default_index_type = next(iter(index_series_by_type))
+    index_series_dict = index_series_by_type.pop(default_index_type)  # the other types are returned separately
+
+    if "Date" in ticker_list:
+        ticker_list.remove("Date")
+    ticker_str = ",".join(ticker_list)
+    set_key(env_file_path, "TICKERS", ticker_str)
+    logger.info(f"MAKE INDEX - QUERY TICKERS SAVED TO GLOBAL ENV: {ticker_str}")
+    #plot_index(series = index_series, index_type = index_type)
+
+    if len(ticker_list)>0:
+        text_avalable_tickers = f"Please find below the historical index performance for following tickers: {', '.join(ticker_list)}"
+    else:
+        text_removed_tickers = ""
+
+    if len(removed_tickers)>0:
+        text_removed_tickers = f"Following tickers in your request were not found: {', '.join(removed_tickers)}"
+    else:
+        text_removed_tickers = ""
+
+
+    return  index_series_dict, text_avalable_tickers, text_removed_tickers, index_series_by_type
+
+
+
+def make_indices(portfolios: Dict[str, List[str]],
+                 start_date: Union[str, pd.Timestamp, None] = None,
+                 end_date: Union[str, pd.Timestamp, None] = None,
+                 index_type: str = 'PR') -> Dict[str, Optional[dict]]:
+    """
+    Builds the price return index series of many portfolios in one pass. The panel is read once for the union of
+    all tickers, the calendar, selection rows and rebalance dates are shared, and the weights of all
+    portfolios are solved together. Returns {portfolio name: index_series dict, or None if it could not be built}.
+    Only PR is supported: the levels are built from unadjusted prices and cached under the PR parameters.
+    """
+    if index_type != 'PR':
+        raise ValueError(f"make_indices only builds PR indices, got {index_type}; use make_index for {index_type}")
+
+    from .inputs import (
+        mcap_threshold, max_cap_value, min_cap_value, scenario,
+        date_adjustment_days, first_index_date, index_start_level,
+        initial_divisor, result_cache_on_disk, top_n
+    )
+
+    ensure_panel_store(price_file_path, price_store_path)
+    ensure_panel_store(mcaps_file_path, mcaps_store_path)
+
+    all_ticker_set = set(read_panel_columns(price_store_path))
+    data_version = get_data_version(price_store_path, mcaps_store_path)
+    cache_db_path = result_db_path if result_cache_on_disk else None
+
+    if start_date is None:
+        start_date = first_index_date
+
+    levels, result_keys, pending = {}, {}, {}
+    for name, tickers in portfolios.items():
+        removed_tickers = [ticker for ticker in tickers if ticker not in all_ticker_set]
+        if removed_tickers:
+            logger.info(f"MAKE INDICES - {name} - TICKERS NOT FOUND: {removed_tickers}")
+
+        found_tickers = [ticker for ticker in tickers if ticker in all_ticker_set]
+        result_keys[name] = make_result_key(found_tickers, make_result_params(index_type), data_version)
+        levels[name] = get_cached_result(result_keys[name], cache_db_path)
+        if levels[name] is None and found_tickers:
+            pending[name] = found_tickers
+
+    if not pending:
+        return rebase_indices(levels, index_start_level, start_date, end_date)
+
+    union_tickers = list(dict.fromkeys(ticker for tickers in pending.values() for ticker in tickers))
+    adj_prices_df = read_panel(price_store_path, union_tickers).rename(columns={'date': 'Date'})
+    mcap_df = read_panel(mcaps_store_path, union_tickers).rename(columns={'date': 'Date'})
+    logger.info(f"MAKE INDICES - {len(pending)} PORTFOLIOS, {len(union_tickers)} DISTINCT TICKERS")
+
+    calendar = TradingCalendar.from_frame(adj_prices_df)
+    mcap_filter_df = filter_mcap(scenario=scenario, weekday = 4, df=mcap_df, calendar=calendar)
+    selection_dates_list, rebalance_dates_list = get_rebalance_dates(mcap_filter_df, adj_prices_df, offset_days = date_adjustment_days, calendar=calendar)
+    mcap_filter_df = mcap_filter_df[mcap_filter_df['Date'].isin(selection_dates_list)]
+
+    weights_by_portfolio = calculate_weights_tensor(mcap_filter_df, rebalance_dates_list, mcap_threshold, max_cap_value, min_cap_value, pending, top_n)
+
+    for name, tickers in pending.items():
+        try:
+            weights, prices, rebalance_dates = prepare_for_index(weights_by_portfolio[name], adj_prices_df[['Date'] + tickers], calendar)
+            _, levels[name], _, _ = make_index_holdings(index_start_level = index_start_level,
+                                                        initial_divisor = initial_divisor,
+                                                        weights = weights,
+                                                        prices = prices,
+                                                        rebalance_dates = rebalance_dates,
+                                                        first_index_date = prices.index[0],  # full history, rebased per request
+                                                        calendar = calendar.since(prices.index[0]))
+        except ValueError as e:
+            logger.info(f"MAKE INDICES - {name} - INDEX NOT BUILT: {e}")
+            continue
+
+        put_cached_result(result_keys[name], levels[name], cache_db_path)
+
+    return rebase_indices(levels, index_start_level, start_date, end_date)
+
+
+def rebase_indices(levels: Dict[str, Optional[pd.Series]],
+                   index_start_level: float,
+                   start_date: Union[str, pd.Timestamp, None],
+                   end_date: Union[str, pd.Timestamp, None]) -> Dict[str, Optional[dict]]:
+    """
+    Rebases the full-history levels of every portfolio to the requested date range (None stays None).
+    """
+    results = {}
+    for name, index_levels in levels.items():
+        try:
+            results[name] = rebase_index_series(index_levels, index_start_level, start_date, end_date).to_dict() if index_levels is not None else None
+        except ValueError as e:
+            logger.info(f"MAKE INDICES - {name} - NO LEVELS IN DATE RANGE: {e}")
+            results[name] = None
+    return results
+
+
+def make_index_sweep(ticker_list: List[str],
+                     scenarios: Optional[List[int]] = None,
+                     mcap_thresholds: Optional[List[float]] = None,
+                     max_cap_values: Optional[List[float]] = None,
+                     min_cap_values: Optional[List[float]] = None,
+                     top_n_values: Optional[List[Optional[int]]] = None,
+                     start_date: Union[str, pd.Timestamp, None] = None,
+                     end_date: Union[str, pd.Timestamp, None] = None,
+                     max_workers: Optional[int] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Runs the price return index of one basket for every combination of the given parameter grids, e.g.
+    make_index_sweep(tickers, scenarios=list(scenarios), max_cap_values=[0.05, 0.1, 0.2], top_n_values=[20, 50, None]).
+    A grid left as None uses the single value from inputs.py. Returns (levels, statistics), see run_parameter_sweep.
+    """
+    from .inputs import (
+        mcap_threshold, max_cap_value, min_cap_value, scenario, top_n,
+        date_adjustment_days, first_index_date, index_start_level, initial_divisor
+    )
+
+    ensure_panel_store(price_file_path, price_store_path)
+    ensure_panel_store(mcaps_file_path, mcaps_store_path)
+
+    all_ticker_set = set(read_panel_columns(price_store_path))
+    removed_tickers = [ticker for ticker in ticker_list if ticker not in all_ticker_set]
+    if removed_tickers:
+        logger.info(f"MAKE INDEX SWEEP - TICKERS NOT FOUND: {removed_tickers}")
+    ticker_list = [ticker for ticker in ticker_list if ticker in all_ticker_set]
+
+    adj_prices_df = read_panel(price_store_path, ticker_list).rename(columns={'date': 'Date'})
+    mcap_df = read_panel(mcaps_store_path, ticker_list).rename(columns={'date': 'Date'})
+
+    param_grid = make_param_grid(scenarios or [scenario],
+                                 mcap_thresholds or [mcap_threshold],
+                                 max_cap_values or [max_cap_value],
+                                 min_cap_values or [min_cap_value],
+                                 top_n_values or [top_n])
+
+    return run_parameter_sweep(adj_prices_df, mcap_df, param_grid,
+                               date_adjustment_days = date_adjustment_days,
+                               index_start_level = index_start_level,
+                               initial_divisor = initial_divisor,
+                               start_date = start_date or first_index_date,
+                               end_date = end_date,
+                               max_workers = max_workers,
+                               price_store_path = price_store_path)
+
+
+def build_index_type(index_type: str, inputs: dict) -> Optional[Tuple[pd.Series, dict]]:
+    """
+    Adjusts the prices for one index type (PR/GTR/NTR) and runs the full-history backtest on the shared weights.
+    If a stored state matches the history, only the new trading days are calculated.
+    Returns the daily index levels and the new state, or None if the type cannot be calculated.
+    """
+    from .inputs import first_index_date, index_start_level, initial_divisor, ignore_past_dividends
+
+    prices_df = inputs['prices_df']
+    calendar = inputs['calendar']
+
+    if index_type != 'PR':
+        dividend_inputs = inputs['dividend_inputs']
+        if dividend_inputs is None:
+            logger.info(f"MAKE INDEX - NO DIVIDEND DATA AVAILABLE, {index_type} SKIPPED")
+            return None
+        divs_df, country_df, tax_df = dividend_inputs
+        prices_df = adjust_prices(prices_df, divs_df, country_df.copy(), tax_df.copy(), ignore_past_dividends, first_index_date, index_type = index_type)
+
+    weights, prices, rebalance_dates =  prepare_for_index(inputs['weights_df'], prices_df, calendar)
+
+    index_state = inputs['index_states'].get(index_type)
+    if index_state is not None and index_state_matches(index_state, weights, prices, rebalance_dates):
+        logger.info(f"MAKE INDEX - {index_type} EXTENDED FROM {index_state['last_date'].date()}")
+        return extend_index_backtest(index_state, weights, prices, rebalance_dates)
+
+    holdings, levels, _, prices = make_index_holdings(index_start_level = index_start_level,
+                                                      initial_divisor = initial_divisor,
+                                                      weights = weights,
+                                                      prices = prices,
+                                                      rebalance_dates = rebalance_dates,
+                                                      first_index_date = prices.index[0],  # full history, rebased per request
+                                                      calendar = calendar.since(prices.index[0]))
+    index_state = make_index_state(holdings, levels, weights, prices, rebalance_dates, initial_divisor)
+    return levels, index_state
+
+
+def build_index_type_from_store(index_type: str, inputs: dict) -> Optional[Tuple[pd.Series, dict]]:
+    """
+    Pool worker of run_index_types: reads the price columns from the memory-mapped store instead of
+    receiving a pickled copy of the panel, then runs build_index_type.
+    """
+    prices_df = read_panel(inputs['price_store_path'], inputs['tickers']).rename(columns={'date': 'Date'})
+    return build_index_type(index_type, {**inputs, 'prices_df': prices_df, 'calendar': TradingCalendar.from_frame(prices_df)})
+
+
+_index_type_pool: Optional[ProcessPoolExecutor] = None  # started once per process and reused by every request
+_index_type_pool_lock = threading.Lock()
+
+
+def get_index_type_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool of run_index_types, one worker per index type (PR/GTR/NTR) up to the CPU count.
+    """
+    global _index_type_pool
+    with _index_type_pool_lock:
+        if _index_type_pool is None:
+            _index_type_pool = ProcessPoolExecutor(max_workers=min(3, os.cpu_count() or 1), mp_context=get_worker_context())
+        return _index_type_pool
+
+
+def run_index_types(index_types: List[str], inputs: dict) -> Dict[str, Tuple[pd.Series, dict]]:
+    """
+    Builds several index types in parallel on the shared pool (see get_worker_context).
+    The workers only receive the weights, their own stored state and, for GTR/NTR, the dividend inputs;
+    the prices are read from inputs['price_store_path']. A single type, inputs without a store
+    or a single CPU run in this process.
+    """
+    if len(index_types) == 1 or inputs.get('price_store_path') is None or (os.cpu_count() or 1) == 1:
+        if len(index_types) > 1:
+            logger.info(f"MAKE INDEX - {len(index_types)} INDEX TYPES BUILT SERIALLY")
+        results = [build_index_type(index_type, inputs) for index_type in index_types]
+        return {index_type: result for index_type, result in zip(index_types, results) if result is not None}
+
+    logger.info(f"MAKE INDEX - {len(index_types)} INDEX TYPES BUILT IN WORKER PROCESSES")
+    worker_inputs = [{
+        'price_store_path': inputs['price_store_path'],
+        'tickers': inputs['prices_df'].columns[1:].tolist(),
+        'weights_df': inputs['weights_df'],
+        'dividend_inputs': inputs['dividend_inputs'] if index_type != 'PR' else None,
+        'index_states': {index_type: inputs['index_states'].get(index_type)},
+    } for index_type in index_types]
+
+    global _index_type_pool
+    try:
+        results = list(get_index_type_pool().map(build_index_type_from_store, index_types, worker_inputs))
+    except BrokenProcessPool:
+        _index_type_pool = None  # a worker died, the next request starts a new pool
+        raise
+
+    return {index_type: result for index_type, result in zip(index_types, results) if result is not None}
+
+
+def make_result_params(index_type: str) -> dict:
+    """
+    Collects the inputs.py parameters that determine the full-history levels, for the result cache key.
+    index_start_level is left out since every request is rebased; first_index_date stays for the dividend adjustment.
+    """
+    from .inputs import (
+        mcap_threshold, max_cap_value, min_cap_value, scenario, date_adjustment_days,
+        first_index_date, initial_divisor, top_n
+    )
+
+    return {
+        'scenario': scenario, 'mcap_threshold': mcap_threshold, 'top_n': top_n, 'max_cap_value': max_cap_value,
+        'min_cap_value': min_cap_value, 'date_adjustment_days': date_adjustment_days,
+        'first_index_date': first_index_date, 'initial_divisor': initial_divisor, 'index_type': index_type,
+    }
@@ -4,6 +4,7 @@
 file_path = 'final_backtest_teq_PR.xlsx'
 
 mcap_threshold = 1000 # MarketCap threshold for filtering companies
+top_n = None          # Keep only the N largest companies above the threshold at each selection date (None = all)
 max_cap_value = 1     # Maximum capping value for weight
 min_cap_value = 0       # Minimum capping value for weight
 
@@ -21,6 +22,11 @@ parent_dir = "data/"
 index_type_list = ['PR']
 #index_type_list = ['PR', 'GTR', 'NTR']
 
+result_cache_size = 128         # Number of finished index series kept in memory (LRU)
+ranking_cache_size = 16         # Number of market cap rankings (dates x tickers) kept in memory (LRU)
+result_cache_on_disk = False    # Also keep finished index series in files/index_results.db
+incremental_updates = True      # Extend stored index states (files/index_results.db) by new trading days only
+
 
 scenarios = {
     1: {'nth_friday': 1, 'frequency': 'M'},
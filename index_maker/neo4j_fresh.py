@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """
 Scheduled runner for make_index_tool.
+With inputs.incremental_updates each run only extends the stored index states by the new trading days.
 """
 import logging
 from apscheduler.schedulers.blocking import BlockingScheduler
@@ -1,6 +1,9 @@
+import os
 import pandas as pd
 import numpy as np
+from typing import Optional, Tuple
 from .inputs import first_index_date, ignore_past_dividends
+from .util_funcs import read_mcap_and_prices
 
 
 def adjust_prices(prices_df: pd.DataFrame, 
@@ -22,15 +25,19 @@ def adjust_prices(prices_df: pd.DataFrame,
     if index_type == 'PR':
         return prices_df
     
-    dividend_prices_df = prices_df.iloc[:,1:].fillna(0).copy()
     divs_df = dividends_df.copy()
+    raw_prices = prices_df.iloc[:, 1:]
+    tickers = raw_prices.columns
 
-    raw_prices = prices_df.iloc[:, 1:].copy()
-    raw_price_returns = (raw_prices/raw_prices.shift(1)) - 1  # Percentage change
-    raw_price_returns = raw_price_returns.fillna(0)
+    raw_price_values = raw_prices.to_numpy(dtype=float)
+    raw_price_returns = np.zeros_like(raw_price_values)  # the first row has no return
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw_price_returns[1:] = raw_price_values[1:] / raw_price_values[:-1] - 1
+    raw_price_returns = np.nan_to_num(raw_price_returns, nan=0.0, posinf=np.inf, neginf=-np.inf)
 
-    first_raw_prices = raw_prices.apply(lambda col: col.where(col.index == col.first_valid_index(), other=np.nan))
-    first_raw_prices.fillna(0,inplace=True)
+    has_price = ~np.isnan(raw_price_values)
+    is_first_price = has_price & (np.cumsum(has_price, axis=0) == 1)
+    first_raw_prices = np.where(is_first_price, raw_price_values, 0.0)
 
     if first_index_date is not None and ignore_past_dividends:
         print('Ignoring Dividends before Index Start Date')
@@ -38,8 +45,7 @@ def adjust_prices(prices_df: pd.DataFrame,
     else:
         print('Dividends before the Index Start Date are included in the calculations')
 
-    if index_type == 'GTR':
-        final_divs_df = divs_df.copy()
+    dividends = divs_df.reindex(index=raw_prices.index, columns=tickers).to_numpy(dtype=float)
 
     if index_type == 'NTR':
         country_df.rename(columns={'Input': 'Ticker', 'Country of Inc.': 'Country'}, inplace=True)  
@@ -47,31 +53,55 @@ def adjust_prices(prices_df: pd.DataFrame,
         ticker_tax_map_df = pd.merge(country_df, tax_df, how='left', on='Country')
         ticker_tax_map_dict = dict(zip(ticker_tax_map_df['Ticker'], ticker_tax_map_df['Tax']))
 
-        tax_adj_divs_df = divs_df.copy()
-        for ticker in ticker_tax_map_dict:
-            if ticker in tax_adj_divs_df.columns:
-                tax_adj_divs_df[ticker] = tax_adj_divs_df[ticker] * (1 - ticker_tax_map_dict[ticker])
-        final_divs_df = tax_adj_divs_df.copy()
+        withholding_tax = np.array([ticker_tax_map_dict.get(ticker, 0) for ticker in tickers], dtype=float)
+        dividends = dividends * (1 - withholding_tax)
 
+    result_values = solve_total_return(raw_price_returns, dividends + first_raw_prices)
 
-    result_df = pd.DataFrame(index = dividend_prices_df.index, columns=dividend_prices_df.columns) # placeholder df
-    previous_dividend_prices_row = pd.Series(0, index=dividend_prices_df.columns)                  # all zero series needed for first row
+    result_df = pd.DataFrame(result_values, index=raw_prices.index, columns=tickers)
+    result_df = result_df.replace(0, np.nan)
+    result_df.insert(0, 'Date', prices_df['Date'])
+    return result_df
 
-    for i, _ in dividend_prices_df.iterrows():
-        dividend_prices_row = dividend_prices_df.loc[i]
-        raw_price_returns_row = raw_price_returns.loc[i]
-        dividends_row = final_divs_df.loc[i]
-        first_raw_prices_row = first_raw_prices.loc[i]
 
-        if i==0:
-            calculated_values = dividends_row + dividend_prices_row + (dividend_prices_row * raw_price_returns_row)
-        else:
-            calculated_values = dividends_row + (previous_dividend_prices_row + first_raw_prices_row) + (previous_dividend_prices_row * raw_price_returns_row)
+def solve_total_return(price_returns: np.ndarray, 
+                       additions: np.ndarray) -> np.ndarray:
+    '''
+    Solves the total return recurrence X_t = X_(t-1) * (1 + r_t) + b_t for every column at once.
+    With A_t = cumprod(1 + r) the solution is X_t = A_t * cumsum(b / A)_t. Columns where a growth factor
+    is zero or not finite cannot be divided through, so they are solved row by row instead.
+    '''
+    growth = 1 + price_returns
+    solvable = np.all(np.isfinite(growth) & (growth > 0), axis=0)
+
+    levels = np.empty_like(additions, dtype=float)
 
-        result_df.loc[i] = calculated_values
-        previous_dividend_prices_row = calculated_values
-    
-    result_df = result_df.astype(float)
-    result_df = result_df.replace(0, np.nan)
-    result_df.insert(0, 'Date', prices_df['Date'])
-    return result_df
\ No newline at end of file
+    cumulative_growth = np.cumprod(growth[:, solvable], axis=0)
+    levels[:, solvable] = cumulative_growth * np.cumsum(additions[:, solvable] / cumulative_growth, axis=0)
+
+    unsolved = ~solvable
+    if unsolved.any():
+        level = np.zeros(unsolved.sum())
+        with np.errstate(invalid='ignore'):
+            for i in range(len(additions)):
+                level = level * growth[i, unsolved] + additions[i, unsolved]
+                levels[i, unsolved] = level
+
+    return levels
+
+
+def load_dividend_inputs(file_path: str, 
+                         prices_df: pd.DataFrame) -> Optional[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    '''
+    Loads dividends, country of incorporation and withholding tax from the backtest workbook and aligns the
+    dividends with the rows and tickers of prices_df (no dividend = 0). Returns None if the workbook is missing.
+    '''
+    if not os.path.exists(file_path):
+        return None
+
+    _, _, dividends_df, country_df, tax_df = read_mcap_and_prices(file_path)
+    aligned_divs_df = prices_df[['Date']].merge(dividends_df, on='Date', how='left')
+    aligned_divs_df = aligned_divs_df.reindex(columns=prices_df.columns).fillna(0)
+    aligned_divs_df['Date'] = prices_df['Date'].to_numpy()
+    aligned_divs_df.index = prices_df.index
+    return aligned_divs_df, country_df, tax_df
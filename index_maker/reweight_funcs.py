@@ -1,5 +1,14 @@
+import logging
 import pandas as pd
-from typing import List, Union
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .inputs import ranking_cache_size
+
+logger = logging.getLogger(__name__)
+
+_ranking_cache: "OrderedDict[Tuple, MarketCapRanking]" = OrderedDict()  # (data version, selection key, tickers) -> ranking, least recently used first
 
 def subset_market_cap(tickers: List[str], 
                       weighting_date: pd.Timestamp, 
@@ -117,3 +126,295 @@ def calculate_weights(df: pd.DataFrame,
         result_min_last_df = result_min_last_df[['Rebalance Date'] + tickers]
 
     return result_min_last_df
+
+
+def market_cap_matrix(df: pd.DataFrame, 
+                      tickers: List[str]) -> np.ndarray:
+    """
+    Returns the market caps of the tickers as a float (dates x tickers) matrix, non-numeric values as NaN.
+    """
+    market_caps = df[tickers].to_numpy()
+    if market_caps.dtype == object:
+        market_caps = pd.to_numeric(pd.Series(market_caps.ravel()), errors='coerce').to_numpy().reshape(market_caps.shape)
+    return market_caps.astype(float)
+
+
+class MarketCapRanking:
+    """
+    The tickers of every selection date pre-sorted by descending market cap (missing market caps last).
+    Built once per selection panel, after which the threshold filter is a binary search per date and
+    a top-N universe is a slice of the sorted tickers.
+    """
+
+    def __init__(self, df: pd.DataFrame, tickers: List[str]):
+        self.tickers = list(tickers)
+        self.dates = pd.DatetimeIndex(df['Date'])
+        market_caps = market_cap_matrix(df, self.tickers)
+
+        sort_keys = np.where(np.isnan(market_caps), np.inf, -market_caps)  # ascending keys = descending market caps
+        self.order = np.argsort(sort_keys, axis=1, kind='stable')
+        self.sorted_keys = np.take_along_axis(sort_keys, self.order, axis=1)
+        self.market_caps = np.nan_to_num(market_caps)
+
+    def count_above(self, threshold: float) -> np.ndarray:
+        """
+        Number of tickers with a market cap above the threshold on every date.
+        """
+        return np.array([np.searchsorted(keys, -threshold, side='left') for keys in self.sorted_keys], dtype=int)
+
+    def top_tickers(self, date: Any, threshold: float, top_n: Optional[int] = None) -> List[str]:
+        """
+        The tickers above the threshold on a selection date, largest first, at most top_n of them.
+        """
+        row = self.dates.get_loc(pd.Timestamp(date))
+        count = np.searchsorted(self.sorted_keys[row], -threshold, side='left')
+        if top_n is not None:
+            count = min(count, top_n)
+        return [self.tickers[position] for position in self.order[row, :count]]
+
+    def eligible_mask(self, threshold: float, top_n: Optional[int] = None) -> np.ndarray:
+        """
+        (dates x tickers) mask of the selected universe: above the threshold and among the top_n largest.
+        """
+        counts = self.count_above(threshold)
+        if top_n is not None:
+            counts = np.minimum(counts, top_n)
+        return self._unsort(np.arange(len(self.tickers))[None, :] < counts[:, None])
+
+    def portfolio_eligible_mask(self, membership: np.ndarray, threshold: float, top_n: Optional[int] = None) -> np.ndarray:
+        """
+        (portfolios x dates x tickers) version of eligible_mask, where top_n counts only the members of each portfolio.
+        """
+        above = np.arange(len(self.tickers))[None, :] < self.count_above(threshold)[:, None]
+        selected = membership[:, self.order] & above[None]
+        if top_n is not None:
+            selected &= np.cumsum(selected, axis=2) <= top_n
+        return self._unsort(selected)
+
+    def _unsort(self, sorted_mask: np.ndarray) -> np.ndarray:
+        mask = np.zeros(sorted_mask.shape, dtype=bool)
+        np.put_along_axis(mask, np.broadcast_to(self.order, sorted_mask.shape), sorted_mask, axis=-1)
+        return mask
+
+
+def get_mcap_ranking(df: pd.DataFrame, 
+                     tickers: List[str], 
+                     data_version: str, 
+                     selection_key: Any) -> MarketCapRanking:
+    """
+    Returns the MarketCapRanking of a selection panel, built once per data version, selection dates
+    (selection_key, e.g. scenario and date adjustment) and ticker set. Rankings of older data versions are dropped
+    and at most ranking_cache_size rankings are kept, least recently used first out.
+    """
+    key = (data_version, selection_key, tuple(tickers))
+    if key not in _ranking_cache:
+        for stale_key in [cached_key for cached_key in _ranking_cache if cached_key[0] != data_version]:
+            del _ranking_cache[stale_key]
+        _ranking_cache[key] = MarketCapRanking(df, tickers)
+    _ranking_cache.move_to_end(key)
+    while len(_ranking_cache) > ranking_cache_size:
+        _ranking_cache.popitem(last=False)
+    return _ranking_cache[key]
+
+
+def cap_weights_matrix(weights: np.ndarray, 
+                       max_cap: float) -> np.ndarray:
+    """
+    Closed-form water-filling of the max cap for a (dates x tickers) weight matrix.
+    For every row it finds the smallest number m of capped stocks such that the remaining stocks,
+    scaled up proportionally to fill 1 - m * max_cap, all stay below the cap. This is the fixed point
+    that the capping loop in apply_reweighting converges to.
+    """
+    n_dates, n_tickers = weights.shape
+    desc = -np.sort(-weights, axis=1)
+    desc = np.hstack([desc, np.zeros((n_dates, 1))])  # m = n_tickers (everything capped) always qualifies
+
+    tail_sums = np.cumsum(desc[:, ::-1], axis=1)[:, ::-1]  # sum of the stocks from position m onwards
+    budgets = 1 - np.arange(n_tickers + 1) * max_cap
+    fits = desc * budgets <= max_cap * tail_sums
+    n_capped = fits.argmax(axis=1)
+
+    rows = np.arange(n_dates)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(tail_sums[rows, n_capped] > 0, budgets[n_capped] / tail_sums[rows, n_capped], np.inf)
+        capped = np.minimum(weights * scale[:, None], max_cap)
+
+    return np.where(weights > 0, capped, 0.0)
+
+
+def floor_weights_matrix(weights: np.ndarray, 
+                         max_cap: float, 
+                         min_cap: float) -> np.ndarray:
+    """
+    Closed-form flooring for a (dates x tickers) weight matrix, the counterpart of cap_weights_matrix.
+    Stocks at the max cap are left untouched, the smallest free stocks are lifted to min_cap and
+    the shortfall is taken proportionally from the other free stocks.
+    """
+    n_dates, n_tickers = weights.shape
+    free = (weights > 0) & (weights < max_cap)
+    n_free = free.sum(axis=1)
+    fixed_total = np.where(free, 0.0, weights).sum(axis=1)
+
+    asc = np.sort(np.where(free, weights, np.inf), axis=1)
+    asc = np.hstack([asc, np.full((n_dates, 1), np.inf)])
+    asc_values = np.where(np.isfinite(asc), asc, 0.0)
+
+    tail_sums = np.cumsum(asc_values[:, ::-1], axis=1)[:, ::-1]
+    budgets = (1 - fixed_total)[:, None] - np.arange(n_tickers + 1) * min_cap
+    positions = np.arange(n_tickers + 1)
+    fits = (asc_values * budgets >= min_cap * tail_sums) | (positions >= n_free[:, None])
+    n_floored = fits.argmax(axis=1)
+
+    rows = np.arange(n_dates)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(tail_sums[rows, n_floored] > 0, budgets[rows, n_floored] / tail_sums[rows, n_floored], 0.0)
+
+    return np.where(free, np.maximum(weights * scale[:, None], min_cap), weights)
+
+
+def clip_weights_matrix(weights: np.ndarray, 
+                        max_cap: float, 
+                        min_cap: float,
+                        iterations: int = 100) -> np.ndarray:
+    """
+    Joint capping and flooring for a (dates x tickers) weight matrix: every stock gets clip(s * w, min_cap, max_cap)
+    with one scale s per row such that the row sums to 1, so the capped stocks are lowered together with the others.
+    s is bracketed by bisection and then solved exactly for the stocks left between the two limits.
+    Rows where the limits cannot both be met (n * min_cap > 1 or n * max_cap < 1) end up at one of the limits.
+    """
+    held = weights > 0
+    low = min_cap / weights.max(axis=1)                              # every stock at or below the floor
+    high = max_cap / np.where(held, weights, np.inf).min(axis=1)     # every stock at or above the cap
+
+    def clipped(scale: np.ndarray) -> np.ndarray:
+        return np.where(held, np.clip(weights * scale[:, None], min_cap, max_cap), 0.0)
+
+    for _ in range(iterations):
+        mid = np.sqrt(low * high)
+        below = clipped(mid).sum(axis=1) < 1
+        low, high = np.where(below, mid, low), np.where(below, high, mid)
+
+    bracket = weights * high[:, None]
+    between = held & (bracket > min_cap) & (bracket < max_cap)
+    at_limits = np.where(held & ~between, np.clip(bracket, min_cap, max_cap), 0.0).sum(axis=1)
+    between_total = np.where(between, weights, 0.0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(between_total > 0, (1 - at_limits) / between_total, high)
+
+    return clipped(scale)
+
+
+def apply_reweighting_matrix(weights: np.ndarray, 
+                             max_cap: float, 
+                             min_cap: float) -> np.ndarray:
+    """
+    Applies capping and flooring to all rebalance dates at once and renormalises every row to 1.
+    The floor is funded by the stocks below the cap. Where that is not enough (the floored row sums to more than 1)
+    the row is solved by clip_weights_matrix instead, which also lowers the capped stocks.
+    """
+    capped = cap_weights_matrix(weights, max_cap)
+    if min_cap <= 0:
+        return capped / capped.sum(axis=1, keepdims=True)
+
+    floored = floor_weights_matrix(capped, max_cap, min_cap)
+    conflicts = floored.sum(axis=1) > 1 + 1e-9
+    if conflicts.any():
+        floored[conflicts] = clip_weights_matrix(weights[conflicts], max_cap, min_cap)
+
+    n_held = (weights > 0).sum(axis=1)
+    infeasible = (n_held * min_cap > 1 + 1e-9) | (n_held * max_cap < 1 - 1e-9)
+    if infeasible.any():
+        logger.warning(f"REWEIGHTING - {infeasible.sum()} REBALANCE DATES CANNOT MEET MAX CAP {max_cap} AND MIN CAP {min_cap}, "
+                       f"{sorted(set(n_held[infeasible].tolist()))} STOCKS, WEIGHTS RENORMALISED")
+
+    return floored / floored.sum(axis=1, keepdims=True)
+
+
+def calculate_weights_matrix(df: pd.DataFrame, 
+                             adjustment_dates_list: List[pd.Timestamp], 
+                             macap_threshold: float, 
+                             max_cap_value: float, 
+                             min_cap_value: float, 
+                             tickers: List[str],
+                             top_n: Optional[int] = None,
+                             ranking: Optional[MarketCapRanking] = None,
+                             verbose: bool = True) -> pd.DataFrame:
+    """
+    Vectorized calculate_weights: thresholding, capping and flooring on a (dates x tickers) matrix.
+    With top_n only the top_n largest companies above the threshold are kept at each date.
+    A prebuilt ranking of the same panel and tickers can be passed to skip the sort.
+    verbose=False silences the per-date messages, e.g. across the runs of a parameter sweep.
+    """
+    if ranking is None:
+        ranking = MarketCapRanking(df, tickers)
+    market_caps = ranking.market_caps
+
+    eligible = ranking.eligible_mask(macap_threshold, top_n)
+    valid_rows = eligible.any(axis=1)
+
+    if verbose:
+        for reweighting_date in df['Date'][~valid_rows]:
+            print(f"Skipping date {reweighting_date} due to no valid companies after filtering.")
+
+    if not valid_rows.any():
+        if verbose:
+            print("Warning: No rebalancing data found. Please verify input criteria and data.")
+        return pd.DataFrame(columns=['Rebalance Date'] + tickers)
+
+    market_caps = np.where(eligible, market_caps, 0.0)[valid_rows]
+    weights = market_caps / market_caps.sum(axis=1, keepdims=True)
+    weights = apply_reweighting_matrix(weights, max_cap_value, min_cap_value)
+
+    result_df = pd.DataFrame(weights, columns=tickers)
+    result_df.insert(0, 'Rebalance Date', np.asarray(adjustment_dates_list)[valid_rows])
+    return result_df
+
+
+def calculate_weights_tensor(df: pd.DataFrame, 
+                             adjustment_dates_list: List[pd.Timestamp], 
+                             macap_threshold: float, 
+                             max_cap_value: float, 
+                             min_cap_value: float, 
+                             portfolios: Dict[str, List[str]],
+                             top_n: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Batch version of calculate_weights_matrix. The market caps of all portfolios are stacked into one
+    (portfolios x dates x tickers) tensor over the union of their tickers, and every (portfolio, date)
+    row goes through the capping/flooring solver in a single call.
+    Returns one weights DataFrame per portfolio, in the calculate_weights format.
+    """
+    union_tickers = list(dict.fromkeys(ticker for tickers in portfolios.values() for ticker in tickers))
+    union_position = {ticker: i for i, ticker in enumerate(union_tickers)}
+
+    ranking = MarketCapRanking(df, union_tickers)
+
+    membership = np.zeros((len(portfolios), len(union_tickers)), dtype=bool)
+    for p, tickers in enumerate(portfolios.values()):
+        membership[p, [union_position[ticker] for ticker in tickers]] = True
+
+    eligible = ranking.portfolio_eligible_mask(membership, macap_threshold, top_n)
+    valid_rows = eligible.any(axis=2)
+
+    market_cap_rows = np.where(eligible, ranking.market_caps[None], 0.0)[valid_rows]
+    weight_rows = np.empty_like(market_cap_rows)
+    if len(market_cap_rows):
+        weight_rows = apply_reweighting_matrix(market_cap_rows / market_cap_rows.sum(axis=1, keepdims=True), max_cap_value, min_cap_value)
+
+    adjustment_dates = np.asarray(adjustment_dates_list)
+    row_offsets = np.concatenate([[0], np.cumsum(valid_rows.sum(axis=1))])
+    results = {}
+    for p, (name, tickers) in enumerate(portfolios.items()):
+        for reweighting_date in df['Date'][~valid_rows[p]]:
+            print(f"Skipping date {reweighting_date} for {name} due to no valid companies after filtering.")
+
+        if not valid_rows[p].any():
+            print(f"Warning: No rebalancing data found for {name}. Please verify input criteria and data.")
+            results[name] = pd.DataFrame(columns=['Rebalance Date'] + tickers)
+            continue
+
+        weights = weight_rows[row_offsets[p]:row_offsets[p + 1]][:, [union_position[ticker] for ticker in tickers]]
+        result_df = pd.DataFrame(weights, columns=tickers)
+        result_df.insert(0, 'Rebalance Date', adjustment_dates[valid_rows[p]])
+        results[name] = result_df
+
+    return results
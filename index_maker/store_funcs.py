@@ -0,0 +1,91 @@
+import os
+import pickle
+import logging
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+_panel_cache: Dict[str, Tuple[float, pa.Table]] = {}  # store path -> (mtime, memory-mapped table)
+
+
+def write_panel_store(df: pd.DataFrame,
+                      store_path: str) -> None:
+    """
+    Writes a wide (date x ticker) panel to an uncompressed Arrow IPC file, so it can be memory-mapped.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_path = f"{store_path}.{os.getpid()}.{threading.get_ident()}.tmp"  # one temp file per writer, concurrent conversions do not collide
+    try:
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, store_path)  # readers never see a half-written store
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def ensure_panel_store(pickle_path: str,
+                       store_path: str) -> str:
+    """
+    Converts the pickled panel to the Arrow store if the store is missing or older than the pickle.
+    """
+    if not os.path.exists(pickle_path):
+        return store_path
+
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(pickle_path):
+        with open(pickle_path, 'rb') as file:
+            df = pickle.load(file)
+        write_panel_store(df, store_path)
+
+    return store_path
+
+
+def load_panel_table(store_path: str) -> pa.Table:
+    """
+    Returns the memory-mapped table for a store from the process-wide cache.
+    The entry is reused as long as the file mtime is unchanged, so warm requests do not read the file.
+    """
+    mtime = os.path.getmtime(store_path)
+    cached = _panel_cache.get(store_path)
+
+    if cached is not None and cached[0] == mtime:
+        logger.info(f"PANEL CACHE - HIT: {os.path.basename(store_path)}")
+        return cached[1]
+
+    table = feather.read_table(store_path, memory_map=True)
+    _panel_cache[store_path] = (mtime, table)
+    mapped_mb = sum(entry[1].nbytes for entry in _panel_cache.values()) / 1024**2
+    logger.info(f"PANEL CACHE - MISS: {os.path.basename(store_path)} loaded, {len(_panel_cache)} panels, {mapped_mb:.1f} MB mapped")
+    return table
+
+
+def reload(store_path: Optional[str] = None) -> None:
+    """
+    Drops one cached panel (or all of them) and loads it again from disk.
+    """
+    store_paths = [store_path] if store_path is not None else list(_panel_cache)
+    for path in store_paths:
+        _panel_cache.pop(path, None)
+        load_panel_table(path)
+
+
+def read_panel_columns(store_path: str) -> List[str]:
+    """
+    Returns the column names of the store.
+    """
+    return load_panel_table(store_path).schema.names
+
+
+def read_panel(store_path: str,
+               tickers: List[str],
+               date_column: str = 'date') -> pd.DataFrame:
+    """
+    Returns the date column and the requested tickers from the cached store.
+    Only the selected columns are converted to pandas.
+    """
+    table = load_panel_table(store_path)
+    return table.select([date_column] + list(tickers)).to_pandas()
@@ -0,0 +1,162 @@
+import os
+import logging
+import itertools
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+from .calendar_funcs import TradingCalendar
+from .util_funcs import filter_mcap, get_rebalance_dates, prepare_for_index, get_worker_context
+from .reweight_funcs import MarketCapRanking, calculate_weights_matrix
+from .backtesting_funcs import make_index_holdings, rebase_index_series, calculate_index_statistics
+from .store_funcs import read_panel
+
+
+logger = logging.getLogger(__name__)
+
+_sweep_inputs: dict = {}  # inputs of run_parameter_sweep, set once per worker process by init_sweep_worker
+
+SWEEP_PARAMS = ['scenario', 'mcap_threshold', 'max_cap_value', 'min_cap_value', 'top_n']
+
+
+def make_param_grid(scenarios: List[Any],
+                    mcap_thresholds: List[float],
+                    max_cap_values: List[float],
+                    min_cap_values: List[float],
+                    top_n_values: List[Optional[int]] = (None,)) -> List[Dict[str, Any]]:
+    """
+    Returns every combination of the parameter grids as a list of dicts.
+    """
+    return [dict(zip(SWEEP_PARAMS, combination))
+            for combination in itertools.product(scenarios, mcap_thresholds, max_cap_values, min_cap_values, top_n_values)]
+
+
+def prepare_sweep_scenarios(prices_df: pd.DataFrame,
+                            mcap_df: pd.DataFrame,
+                            scenarios: List[Any],
+                            date_adjustment_days: int,
+                            calendar: TradingCalendar) -> Dict[Any, Tuple[pd.DataFrame, List[pd.Timestamp], MarketCapRanking]]:
+    """
+    Computes the selection rows of the market cap panel, the rebalance dates and the market cap ranking
+    once per scenario. All cap, threshold and top-N combinations of a scenario share them.
+    """
+    scenario_inputs = {}
+    for scenario in scenarios:
+        mcap_filter_df = filter_mcap(scenario=scenario, weekday = 4, df=mcap_df, calendar=calendar)
+        selection_dates_list, rebalance_dates_list = get_rebalance_dates(mcap_filter_df, prices_df, offset_days = date_adjustment_days, calendar=calendar)
+        mcap_filter_df = mcap_filter_df[mcap_filter_df['Date'].isin(selection_dates_list)]
+        scenario_inputs[scenario] = (mcap_filter_df, rebalance_dates_list, MarketCapRanking(mcap_filter_df, mcap_df.columns[1:].tolist()))
+    return scenario_inputs
+
+
+def init_sweep_worker(inputs: Dict[str, Any]) -> None:
+    """
+    Publishes the sweep inputs in the worker process. With a price_store_path the price columns are read
+    from the memory-mapped store instead of being pickled to every worker.
+    """
+    global _sweep_inputs
+    if inputs.get('prices_df') is None:
+        prices_df = read_panel(inputs['price_store_path'], inputs['tickers']).rename(columns={'date': 'Date'})
+        inputs = {**inputs, 'prices_df': prices_df, 'calendar': TradingCalendar.from_frame(prices_df)}
+    _sweep_inputs = inputs
+
+
+def run_sweep_combination(params: Dict[str, Any]) -> Tuple[Optional[pd.Series], Optional[pd.Series], Optional[str]]:
+    """
+    Builds the index levels of one parameter combination from the shared sweep inputs.
+    Returns the daily and the month-start levels rebased to the sweep date range, or None and the reason it could not be built.
+    The per-date progress messages are switched off, they are not useful across hundreds of runs.
+    """
+    prices_df = _sweep_inputs['prices_df']
+    calendar = _sweep_inputs['calendar']
+    mcap_filter_df, rebalance_dates_list, mcap_ranking = _sweep_inputs['scenario_inputs'][params['scenario']]
+    tickers = prices_df.columns[1:].tolist()
+
+    try:
+        weights_df = calculate_weights_matrix(mcap_filter_df, rebalance_dates_list, params['mcap_threshold'],
+                                              params['max_cap_value'], params['min_cap_value'], tickers,
+                                              top_n=params['top_n'], ranking=mcap_ranking, verbose=False)
+        weights, prices, rebalance_dates = prepare_for_index(weights_df, prices_df, calendar)
+        _, levels, _, _ = make_index_holdings(index_start_level = _sweep_inputs['index_start_level'],
+                                              initial_divisor = _sweep_inputs['initial_divisor'],
+                                              weights = weights,
+                                              prices = prices,
+                                              rebalance_dates = rebalance_dates,
+                                              first_index_date = prices.index[0],
+                                              calendar = calendar.since(prices.index[0]),
+                                              verbose = False)
+        index_series = rebase_index_series(levels, _sweep_inputs['index_start_level'],
+                                           _sweep_inputs['start_date'], _sweep_inputs['end_date'], month_start=False)
+        month_start_series = rebase_index_series(levels, _sweep_inputs['index_start_level'],
+                                                 _sweep_inputs['start_date'], _sweep_inputs['end_date'])
+    except (ValueError, KeyError) as e:
+        return None, None, str(e)
+
+    return index_series, month_start_series, None
+
+
+def run_parameter_sweep(prices_df: pd.DataFrame,
+                        mcap_df: pd.DataFrame,
+                        param_grid: List[Dict[str, Any]],
+                        date_adjustment_days: int,
+                        index_start_level: float,
+                        initial_divisor: float,
+                        start_date: Union[str, pd.Timestamp, None] = None,
+                        end_date: Union[str, pd.Timestamp, None] = None,
+                        max_workers: Optional[int] = None,
+                        price_store_path: Optional[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Runs the index for every parameter combination of param_grid (see make_param_grid) on one loaded panel.
+    The calendar and the per-scenario selection rows and rebalance dates are built once and handed to every
+    worker of a process pool (see get_worker_context) when it starts. If prices_df was read from price_store_path,
+    the workers read it from the memory-mapped store themselves. Returns two tidy tables:
+    - levels: one row per combination and month-start date with the Index Level
+    - statistics: one row per combination with the summary statistics (or the error that prevented the run)
+    """
+    global _sweep_inputs
+
+    calendar = TradingCalendar.from_frame(prices_df)
+    scenarios = list(dict.fromkeys(params['scenario'] for params in param_grid))
+    logger.info(f"PARAMETER SWEEP - {len(param_grid)} COMBINATIONS, {len(scenarios)} SCENARIOS, {prices_df.shape[1] - 1} TICKERS")
+
+    sweep_inputs = {
+        'prices_df': prices_df,
+        'calendar': calendar,
+        'scenario_inputs': prepare_sweep_scenarios(prices_df, mcap_df, scenarios, date_adjustment_days, calendar),
+        'index_start_level': index_start_level,
+        'initial_divisor': initial_divisor,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(param_grid))
+    if max_workers > 1:
+        if price_store_path is not None:
+            worker_inputs = {**sweep_inputs, 'prices_df': None, 'calendar': None,
+                             'price_store_path': price_store_path, 'tickers': prices_df.columns[1:].tolist()}
+        else:
+            worker_inputs = sweep_inputs
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_worker_context(),
+                                 initializer=init_sweep_worker, initargs=(worker_inputs,)) as pool:
+            results = list(pool.map(run_sweep_combination, param_grid, chunksize=max(1, len(param_grid) // (4 * max_workers))))
+    else:
+        logger.info("PARAMETER SWEEP - ONE WORKER, COMBINATIONS BUILT SERIALLY")
+        try:
+            _sweep_inputs = sweep_inputs
+            results = [run_sweep_combination(params) for params in param_grid]
+        finally:
+            _sweep_inputs = {}
+
+    level_frames, statistics_rows = [], []
+    for params, (index_series, month_start_series, error) in zip(param_grid, results):
+        if index_series is None:
+            statistics_rows.append({**params, 'error': error})
+            continue
+
+        statistics_rows.append({**params, 'first_date': index_series.index[0], 'last_date': index_series.index[-1],
+                                **calculate_index_statistics(index_series), 'error': None})
+        level_frames.append(pd.DataFrame({**params, 'Date': month_start_series.index, 'Index Level': month_start_series.to_numpy()}))
+
+    levels_df = pd.concat(level_frames, ignore_index=True) if level_frames else pd.DataFrame(columns=SWEEP_PARAMS + ['Date', 'Index Level'])
+    statistics_df = pd.DataFrame(statistics_rows)
+    logger.info(f"PARAMETER SWEEP - {len(level_frames)} OF {len(param_grid)} COMBINATIONS BUILT")
+    return levels_df, statistics_df
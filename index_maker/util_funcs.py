@@ -1,11 +1,13 @@
 import os
+import multiprocessing
 import pandas as pd 
 from .inputs import scenarios, index_start_level, parent_dir
+from .calendar_funcs import TradingCalendar, get_selection_dates
 from datetime import timedelta
 import matplotlib.pyplot as plt
 from pytz import timezone
 from datetime import datetime, timedelta
-from typing import Tuple, List, Any
+from typing import Tuple, List, Any, Optional
 
 def read_mcap_and_prices(file_path: str, 
                          mcap_sheet: str = 'MarketCap', 
@@ -44,32 +46,18 @@ def read_mcap_and_prices(file_path: str,
 def filter_mcap(scenario: str, 
                 weekday: int, 
                 df: pd.DataFrame, 
-                scenarios: dict=scenarios) -> pd.DataFrame:
+                scenarios: dict=scenarios,
+                calendar: Optional[TradingCalendar] = None) -> pd.DataFrame:
     """
-    Filters the MarketCap DataFrame by scenario and weekday, returning rows for Nth Friday of specific months.
+    Filters the MarketCap DataFrame by scenario and weekday, returning rows for the Nth Friday
+    of every month (M), quarter (Q) or of the scenario months (Semi-Annual).
     """
-    df = df.copy()
-    df['Weekday'] = df['Date'].dt.weekday
-    df['Month'] = df['Date'].dt.month
-    df['Quarter'] = df['Date'].dt.to_period('Q')
+    if calendar is None:
+        calendar = TradingCalendar.from_frame(df)
 
-    filter_friday_df = df[df['Weekday'] == weekday]
+    selection_dates = get_selection_dates(calendar, scenario, weekday, scenarios)
 
-    params = scenarios[scenario]
-    nth_friday = params['nth_friday']
-    frequency = params['frequency']
-    months = params.get('months', None)
-
-    if frequency == 'Semi-Annual':
-        filter_friday_months_df = filter_friday_df[filter_friday_df['Month'].isin(months)]
-        filter_nth_friday_month_df = (
-            filter_friday_months_df.groupby(filter_friday_months_df['Date'].dt.to_period('M'))
-            .nth(nth_friday - 1)
-            .reset_index(drop=True)
-        )
-    else:
-        raise ValueError(f"Invalid frequency, check the Scenarios dictionary")
-    
+    filter_nth_friday_month_df = df[df['Date'].isin(selection_dates)].reset_index(drop=True)
     return filter_nth_friday_month_df
 
 
@@ -90,34 +78,28 @@ def date_parser(date: Any) -> pd.Timestamp:
 
 def get_rebalance_dates(df_a: pd.DataFrame, 
                          df_b: pd.DataFrame, 
-                         offset_days: int) -> Tuple[List[pd.Timestamp], List[pd.Timestamp]]:
+                         offset_days: int,
+                         calendar: Optional[TradingCalendar] = None) -> Tuple[List[pd.Timestamp], List[pd.Timestamp]]:
     """
     Calculates adjustment dates based on a reweighting date and an offset in days.
+    The adjustment date is the first date of df_b (or of the given calendar) on or after the target date.
     """
-    list_a = pd.to_datetime(df_a.iloc[:, 0]).tolist()
-    list_b = sorted(pd.to_datetime(df_b.iloc[:, 0]).tolist())  # Sort list_b for efficient searching
+    if calendar is None:
+        calendar = TradingCalendar(df_b.iloc[:, 0])
 
-    reweighting_dates = []
-    adjustment_dates = []
+    reweighting_dates = pd.DatetimeIndex(pd.to_datetime(df_a.iloc[:, 0])).normalize()
+    target_dates = reweighting_dates + timedelta(days=offset_days)
+    adjustment_dates, found = calendar.next_on_or_after(target_dates)
 
-    for reweighting_date in list_a:
-        target_date = reweighting_date + timedelta(days=offset_days)
-        
-        # Find the first date in list_b that is >= target_date
-        adjustment_date = next((d for d in list_b if d >= target_date), None)
+    for reweighting_date in reweighting_dates[~found]:
+        print(f"Warning: Skipping the rebalancing date {reweighting_date}, because there is no available price data")
 
-        if adjustment_date is None:
-            print(f"Warning: Skipping the rebalancing date {reweighting_date}, because there is no available price data")
-            continue
-        
-        reweighting_dates.append(reweighting_date.normalize())
-        adjustment_dates.append(adjustment_date.normalize()) 
-    
-    return reweighting_dates, adjustment_dates
+    return list(reweighting_dates[found]), list(adjustment_dates)
 
 
 def prepare_for_index(weights_df: pd.DataFrame, 
-                      prices_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DatetimeIndex]:
+                      prices_df: pd.DataFrame,
+                      calendar: Optional[TradingCalendar] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DatetimeIndex]:
     
     """
     Prepares data for rebalancing by aligning weights df and prices df and setting the start date for price df.
@@ -134,7 +116,11 @@ def prepare_for_index(weights_df: pd.DataFrame,
     # Normalize indices and extract rebalance dates
     weights_bkts_df.index = pd.to_datetime(weights_bkts_df.index).normalize()
     prices_bkts_df.index = pd.to_datetime(prices_bkts_df.index).normalize()
-    rebal_dates = weights_bkts_df.index.intersection(prices_bkts_df.index).normalize()
+
+    if calendar is None:
+        calendar = TradingCalendar(prices_bkts_df.index)
+    weight_dates = weights_bkts_df.index.unique().sort_values()
+    rebal_dates = weight_dates[calendar.contains(weight_dates) & (weight_dates >= first_rebal_date.normalize())]
 
     return weights_bkts_df.sort_index(), prices_bkts_df.sort_index(), rebal_dates
 
@@ -215,3 +201,17 @@ def save_rebalancing_results(save_results: bool,
     current_timestamp_cet = datetime.now(cet).strftime('%Y%m%d_%H%M%S')
     current_date_cet = datetime.now(cet).strftime('%Y%m%d')
                                                   
+
+
+def get_worker_context() -> multiprocessing.context.BaseContext:
+    """
+    Start method of the process pools. Forking from a threaded process (the FastAPI server, the scheduler's
+    thread pool, a notebook kernel) can leave a child with locks held by other threads, so the workers are
+    started by a forkserver (spawn where it is not available), with the index_maker modules preloaded.
+    The workers do not share the parent's memory: they read the price panel from the memory-mapped store.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([f"{__package__}.index_maker"])
+        return context
+    return multiprocessing.get_context('spawn')
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+sys.path.insert(0, os.path.join(repo_dir, 'data_prep'))
+
+
+@pytest.fixture(scope='session', autouse=True)
+def data_prep_workdir(tmp_path_factory):
+    """
+    data_prep/utils/db_funcs opens ../stocks_data.db relative to the working directory on import,
+    so the tests run (and import the utils modules) from a scratch directory.
+    """
+    workdir = tmp_path_factory.mktemp('data_prep') / 'work'
+    workdir.mkdir()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    yield workdir
+    os.chdir(cwd)
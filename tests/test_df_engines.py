@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope='module')
+def df_funcs():
+    from utils import df_funcs
+    return df_funcs
+
+
+@pytest.fixture(scope='module')
+def panels():
+    """
+    Small wide price and mcap panels, newest date first as returned by transpose_df:
+    stocks listed late, with short and long gaps, without recent values, without any value,
+    a weekend row and a stock that only has prices.
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2022-01-03', '2024-11-29').union(pd.DatetimeIndex(['2023-03-04']))
+    n = len(dates)
+
+    prices = {}
+    for i in range(12):
+        prices[f'S{i}'] = np.cumprod(1 + rng.normal(0, 0.01, n)) * (10 + i)
+        prices[f'S{i}'][rng.random(n) < 0.03] = np.nan
+
+    prices['S1'][:300] = np.nan               # listed late
+    prices['S2'][:700] = np.nan               # listed too late for the trim
+    prices['S3'][400:440] = np.nan            # gap longer than gap_size
+    prices['S4'][400:410] = np.nan            # gap shorter than gap_size
+    prices['S5'][-30:] = np.nan               # no recent values
+    prices['S6'][:] = np.nan                  # no values at all
+
+    mcaps = {stock: values * 1000 for stock, values in prices.items() if stock != 'S7'}
+    mcaps['S8'] = mcaps['S8'].copy()
+    mcaps['S8'][:320] = np.nan                # mcaps start after prices
+    mcaps['X0'] = prices['S0'] * 5            # mcaps without prices
+
+    def to_panel(columns):
+        df = pd.DataFrame(columns)
+        df.insert(0, 'date', dates.strftime('%Y-%m-%d'))
+        return df.sort_values('date', ascending=False).reset_index(drop=True)
+
+    return to_panel(prices), to_panel(mcaps)
+
+
+@pytest.mark.parametrize('calendar', ['D', 'B'])
+def test_pandas_and_polars_engines_match(df_funcs, panels, calendar, capsys):
+    stock_prices, stock_mcaps = panels
+    kwargs = dict(gap_size=20, days=250, calendar=calendar, start_date='2022-01-01')
+
+    pandas_prices, pandas_mcaps, pandas_removed = df_funcs.prepare_panels(stock_prices.copy(), stock_mcaps.copy(), engine='pandas', **kwargs)
+    polars_prices, polars_mcaps, polars_removed = df_funcs.prepare_panels(stock_prices.copy(), stock_mcaps.copy(), engine='polars', **kwargs)
+
+    pd.testing.assert_frame_equal(pandas_prices.reset_index(drop=True), polars_prices, check_exact=False, rtol=1e-9)
+    pd.testing.assert_frame_equal(pandas_mcaps.reset_index(drop=True), polars_mcaps, check_exact=False, rtol=1e-9)
+    assert pandas_removed == polars_removed
+
+    kept = set(pandas_prices.columns) - {'date'}
+    assert {'S0', 'S1', 'S4'} <= kept
+    assert not kept & {'S2', 'S3', 'S5', 'S6', 'S7', 'X0'}
+    if calendar == 'B':
+        assert (pandas_prices['date'].dt.dayofweek < 5).all()
+
+
+def test_recent_values_window_follows_last_date(df_funcs):
+    dates = pd.bdate_range('2025-01-01', '2025-06-30')
+    df = pd.DataFrame({'A': np.ones(len(dates)), 'B': np.ones(len(dates)), 'C': np.ones(len(dates))})
+    df.loc[len(dates) - 25:, 'B'] = np.nan   # no value in the last five weeks
+    df.loc[len(dates) - 15:, 'C'] = np.nan   # last value within the window
+    df.insert(0, 'date', dates.strftime('%Y-%m-%d'))
+    df = df.sort_values('date', ascending=False).reset_index(drop=True)
+
+    assert list(df_funcs.remove_stocks_witn_no_recent_values(df).columns) == ['date', 'A', 'C']
+    assert df_funcs.select_stocks_polars(df_funcs.to_polars_panel(df), gap_size=20) == ['A', 'C']
@@ -0,0 +1,120 @@
+import time
+import asyncio
+import threading
+import pytest
+from aiohttp import web
+
+
+PORT = 8791
+
+
+@pytest.fixture(scope='module')
+def stub_server():
+    """
+    Local stand-in for the FMP API:
+    /ok/{symbol} answers, /flaky/{symbol} is rate limited once, /error/{symbol} always fails with 500
+    and /denied/{symbol} answers 401 like an invalid API key.
+    """
+    hits = {}
+
+    async def handler(request):
+        kind, symbol = request.match_info['kind'], request.match_info['symbol']
+        hits[(kind, symbol)] = hits.get((kind, symbol), 0) + 1
+        if kind == 'flaky' and hits[(kind, symbol)] == 1:
+            return web.Response(status=429, headers={'Retry-After': '0'})
+        if kind == 'error':
+            return web.Response(status=500, headers={'Retry-After': '0'})
+        if kind == 'denied':
+            return web.Response(status=401, text='Invalid API KEY')
+        return web.json_response([{'symbol': symbol, 'apikey': request.query['apikey']}])
+
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_get('/{kind}/{symbol}', handler)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', PORT).start())
+        started.set()
+        loop.run_forever()
+        loop.run_until_complete(runner.cleanup())
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait(5)
+    yield hits
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+@pytest.fixture
+def fmp(tmp_path, monkeypatch):
+    from utils import fmp_funcs
+    monkeypatch.setattr(fmp_funcs, 'cache_dir', str(tmp_path / 'http_cache'))
+    return fmp_funcs
+
+
+def make_urls(kind, symbols):
+    return {symbol: f'http://127.0.0.1:{PORT}/{kind}/{symbol}?apikey={{api_key}}' for symbol in symbols}
+
+
+def test_retries_and_failures(stub_server, fmp):
+    urls = {**make_urls('ok', ['A', 'B']), **make_urls('flaky', ['C']), **make_urls('error', ['D']), **make_urls('denied', ['E'])}
+
+    results, failed_keys = asyncio.run(fmp.fetch_all(urls, 'KEY', max_retries=2, max_age=0))
+
+    assert sorted(results) == ['A', 'B', 'C']
+    assert results['C'] == [{'symbol': 'C', 'apikey': 'KEY'}]
+    assert sorted(failed_keys) == ['D', 'E']
+    assert stub_server[('flaky', 'C')] == 2     # retried after the 429
+    assert stub_server[('error', 'D')] == 3     # first attempt and two retries
+    assert stub_server[('denied', 'E')] == 1    # not retried
+
+
+def test_key_fails_if_any_url_fails(stub_server, fmp):
+    urls = {'F': [make_urls('ok', ['F1'])['F1'], make_urls('error', ['F2'])['F2']]}
+    stored = {}
+
+    results, failed_keys = asyncio.run(fmp.fetch_all(urls, 'KEY', on_result=stored.__setitem__, max_retries=0, max_age=0))
+
+    assert failed_keys == ['F'] and stored == {} and results == {}
+
+
+def test_rate_limit(stub_server, fmp):
+    urls = make_urls('ok', [f'R{i}' for i in range(20)])
+
+    start = time.monotonic()
+    results, failed_keys = asyncio.run(fmp.fetch_all(urls, 'KEY', calls_per_minute=600, max_age=0))
+    elapsed = time.monotonic() - start
+
+    # 10 calls per second with a burst of 10: the second half of the calls waits about a second
+    assert len(results) == 20 and failed_keys == []
+    assert elapsed >= 0.9
+
+
+def test_resume_from_progress_file(stub_server, fmp, tmp_path):
+    progress_file = str(tmp_path / 'progress.txt')
+    urls = {**make_urls('ok', ['P1', 'P2']), **make_urls('denied', ['P3']), **make_urls('error', ['P4'])}
+
+    _, failed_keys = asyncio.run(fmp.fetch_all(urls, 'KEY', progress_file=progress_file, max_retries=0, max_age=0))
+    assert sorted(failed_keys) == ['P3', 'P4']
+    assert fmp.read_progress(progress_file) == {'P1', 'P2'}     # failed keys are never recorded as done
+
+    results, failed_keys = asyncio.run(fmp.fetch_all(urls, 'KEY', progress_file=progress_file, max_retries=0, max_age=0))
+    assert results == {} and sorted(failed_keys) == ['P3', 'P4']
+    assert stub_server[('ok', 'P1')] == 1 and stub_server[('ok', 'P2')] == 1     # skipped on resume
+    assert stub_server[('error', 'P4')] == 2
+
+
+def test_get_data_retries_are_bounded(stub_server, fmp):
+    assert fmp.get_data(make_urls('flaky', ['G1'])['G1'], 'KEY', max_age=0) == [{'symbol': 'G1', 'apikey': 'KEY'}]
+    assert fmp.get_data(make_urls('error', ['G2'])['G2'], 'KEY', max_age=0, max_retries=2) == {}
+    assert fmp.get_data(make_urls('denied', ['G3'])['G3'], 'KEY', max_age=0) == {}
+
+    assert stub_server[('flaky', 'G1')] == 2
+    assert stub_server[('error', 'G2')] == 3     # first attempt and two retries
+    assert stub_server[('denied', 'G3')] == 1    # not retried
+    assert fmp.read_cache(make_urls('error', ['G2'])['G2'].format(api_key='KEY')) is None     # failures are not cached
@@ -0,0 +1,74 @@
+import os
+import sys
+import types
+import asyncio
+import pytest
+
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chatbot_api', 'src')
+
+
+@pytest.fixture
+def agent_module(monkeypatch):
+    """
+    The agent module with the Graph and Special chains replaced, since they connect to Neo4j on import.
+    """
+    monkeypatch.setenv('OPENAI_API_KEY', 'test-key')
+    monkeypatch.setenv('INDEX_AGENT_MODEL', 'gpt-4o-mini')
+    monkeypatch.syspath_prepend(SRC_DIR)
+    for name, attribute in [('chains.index_cypher_chain', 'index_cypher_chain'),
+                            ('chains.index_description_chain', 'description_vector_chain')]:
+        module = types.ModuleType(name)
+        setattr(module, attribute, types.SimpleNamespace(invoke=lambda query: {}))
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.delitem(sys.modules, 'agents.index_rag_agent', raising=False)
+
+    import agents.index_rag_agent as agent_module
+    return agent_module
+
+
+def scripted_agent(tool_input):
+    """
+    Stands in for the LLM: calls the Index tool once with tool_input (the tool returns directly).
+    """
+    from langchain.agents import BaseSingleActionAgent
+    from langchain_core.agents import AgentAction, AgentFinish
+
+    class ScriptedAgent(BaseSingleActionAgent):
+        @property
+        def input_keys(self):
+            return ['input']
+
+        def plan(self, intermediate_steps, **kwargs):
+            if not intermediate_steps:
+                return AgentAction(tool='Index', tool_input=tool_input, log='')
+            return AgentFinish({'output': intermediate_steps[-1][1]}, log='')
+
+        async def aplan(self, intermediate_steps, **kwargs):
+            return self.plan(intermediate_steps, **kwargs)
+
+    return ScriptedAgent()
+
+
+@pytest.mark.parametrize('tool_input, request_range, expected', [
+    ('AAPL, MSFT', ('2020-01-01', '2023-12-31'), ('AAPL, MSFT', '2020-01-01', '2023-12-31')),
+    ('AAPL, MSFT', (None, None), ('AAPL, MSFT', None, None)),
+])
+def test_index_tool_receives_request_date_range(agent_module, monkeypatch, tool_input, request_range, expected):
+    calls = []
+
+    def make_index_tool(ticker_input=None, _input=None, start_date=None, end_date=None):
+        calls.append((ticker_input, start_date, end_date))
+        return 'index levels'
+
+    monkeypatch.setattr(agent_module, 'make_index_tool', make_index_tool)
+    monkeypatch.setattr(agent_module.index_rag_agent_executor, 'agent', scripted_agent(tool_input))
+
+    async def request():
+        agent_module.requested_date_range.set(request_range)    # as the endpoint does
+        return await agent_module.index_rag_agent_executor.ainvoke({'input': f'Make Index {tool_input}'})
+
+    result = asyncio.run(request())
+
+    assert calls == [expected]
+    assert result['output'] == 'index levels'
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from index_maker.reweight_funcs import apply_reweighting_matrix, cap_weights_matrix, floor_weights_matrix
+
+
+def test_cap_and_floor_conflict_lowers_capped_stock():
+    # one dominant stock and 13 small ones: with the dominant stock held at the cap, the small ones
+    # cannot all be lifted to the floor (0.487 + 13 * 0.048 = 1.111), so the cap has to give way
+    weights = np.r_[0.9, np.full(13, 0.1 / 13)][None, :]
+    max_cap, min_cap = 0.487, 0.048
+
+    floored = floor_weights_matrix(cap_weights_matrix(weights, max_cap), max_cap, min_cap)
+    assert floored.sum() > 1.1
+
+    result = apply_reweighting_matrix(weights, max_cap, min_cap)
+    assert result.sum() == pytest.approx(1)
+    assert result.min() == pytest.approx(min_cap)
+    assert result.max() == pytest.approx(1 - 13 * min_cap)
+
+
+def test_limits_hold_on_random_rows():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n = rng.integers(2, 40)
+        max_cap = rng.uniform(1 / n, 0.6)
+        min_cap = rng.uniform(0, 1 / n)
+        weights = rng.lognormal(0, 2, (5, n))
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        result = apply_reweighting_matrix(weights, max_cap, min_cap)
+        np.testing.assert_allclose(result.sum(axis=1), 1)
+        assert result.max() <= max_cap + 1e-9
+        assert result.min() >= min_cap - 1e-9